@@ -1,7 +1,7 @@
 import numpy as np
 from math import ceil
 import itertools
-from collections import Iterator
+from collections import Iterator, Mapping
 from functools import partial
 from toolz.curried import (identity, pipe, partition, concat, unique, pluck,
         frequencies, join, first, memoize, map, groupby, valmap)
@@ -9,7 +9,7 @@ from .utils import deepmap
 import operator
 
 
-def getem(arr, blocksize, shape):
+def getem(arr, blocksize=None, shape=None, blockdims=None):
     """ Dask getting various chunks from an array-like
 
     >>> getem('X', blocksize=(2, 3), shape=(4, 6))  # doctest: +SKIP
@@ -17,14 +17,61 @@ def getem(arr, blocksize, shape):
      ('X', 1, 0): (operator.getitem, 'X', (slice(2, 4), slice(0, 3))),
      ('X', 1, 1): (operator.getitem, 'X', (slice(2, 4), slice(3, 6))),
      ('X', 0, 1): (operator.getitem, 'X', (slice(0, 2), slice(3, 6)))}
+
+    Blocks may vary in size if we give the sizes along each axis
+
+    >>> getem('X', blockdims=((2, 2), (1, 5)))  # doctest: +SKIP
+    {('X', 0, 0): (operator.getitem, 'X', (slice(0, 2), slice(0, 1))),
+     ('X', 1, 0): (operator.getitem, 'X', (slice(2, 4), slice(0, 1))),
+     ('X', 1, 1): (operator.getitem, 'X', (slice(2, 4), slice(1, 6))),
+     ('X', 0, 1): (operator.getitem, 'X', (slice(0, 2), slice(1, 6)))}
     """
-    numblocks = tuple([int(ceil(n/k)) for n, k in zip(shape, blocksize)])
+    if blockdims is None:
+        blockdims = blockdims_from_blockshape(shape, blocksize)
+    starts = [np.cumsum((0,) + tuple(bd)).tolist() for bd in blockdims]
     return dict(
                ((arr,) + ijk,
                (operator.getitem,
                  arr,
-                 tuple(slice(i*d, (i+1)*d) for i, d in zip(ijk, blocksize))))
-               for ijk in itertools.product(*map(range, numblocks)))
+                 tuple(slice(s[i], s[i+1]) for i, s in zip(ijk, starts))))
+               for ijk in itertools.product(*[range(len(bd))
+                                              for bd in blockdims]))
+
+
+def blockshape_from_chunks(shape, chunks, itemsize, nbytes=2**24,
+                           nblocks=1):
+    """ Blockshape made of whole storage chunks
+
+    Grow ``chunks`` by integer multiples, last axis first, until blocks hold
+    about ``nbytes`` bytes, while keeping at least ``nblocks`` blocks so that
+    every thread has work.
+
+    >>> blockshape_from_chunks((1000, 1000), (10, 100), itemsize=8,
+    ...                        nbytes=80000)
+    (10, 1000)
+    >>> blockshape_from_chunks((1000, 1000), (10, 100), itemsize=8,
+    ...                        nbytes=800000)
+    (100, 1000)
+
+    Keep enough blocks for all threads
+
+    >>> blockshape_from_chunks((1000, 1000), (10, 100), itemsize=8,
+    ...                        nbytes=8000000, nblocks=4)
+    (250, 1000)
+    """
+    block = [max(1, min(c, s)) for c, s in zip(chunks, shape)]
+    for i in reversed(range(len(shape))):
+        size = itemsize * int(np.prod(block))
+        k = max(1, nbytes // size)
+        others = int(np.prod([ceil(s / float(b)) for j, (s, b)
+                              in enumerate(zip(shape, block)) if j != i]))
+        needed = int(ceil(nblocks / float(others)))
+        if needed > 1:
+            k = min(k, max(1, shape[i] // (needed * block[i])))
+        else:
+            k = min(k, int(ceil(shape[i] / float(block[i]))))
+        block[i] = min(block[i] * k, shape[i])
+    return tuple(block)
 
 
 def dotmany(A, B, leftfunc=None, rightfunc=None, **kwargs):
@@ -46,7 +93,39 @@ def dotmany(A, B, leftfunc=None, rightfunc=None, **kwargs):
         A = map(leftfunc, A)
     if rightfunc:
         B = map(rightfunc, B)
-    return sum(map(partial(np.dot, **kwargs), A, B))
+    return sum_blocks(map(partial(np.dot, **kwargs), A, B), copy=False)
+
+
+def sum_blocks(blocks, copy=True):
+    """ Sum many blocks, accumulating into a single buffer
+
+    Supports nested lists and iterators of blocks, as given by ``top``.
+
+    >>> x = np.ones(3, dtype='i4')
+    >>> sum_blocks([[x, x], [x]]).tolist()
+    [3, 3, 3]
+    >>> x.tolist()  # inputs are untouched
+    [1, 1, 1]
+
+    Set ``copy=False`` to reuse the memory of the first block, only safe when
+    the blocks are fresh intermediates that no one else holds.
+    """
+    total = None
+    for b in blocks:
+        owned = not copy
+        if isinstance(b, (list, Iterator)):
+            b, owned = sum_blocks(b, copy=copy), True
+        if total is None:
+            total = np.asarray(b) if owned else np.array(b)
+            continue
+        dtype = np.result_type(total, b)
+        if dtype != total.dtype:
+            total = total.astype(dtype)
+        if total.shape == np.shape(b):
+            np.add(total, b, out=total)
+        else:  # Broadcasting may grow the result
+            total = total + b
+    return total
 
 
 def lol_tuples(head, ind, values, dummies):
@@ -127,6 +206,12 @@ def broadcast_dimensions(argpairs, numblocks):
     >>> numblocks = {'x': (2, 1), 'y': (1, 3)}
     >>> broadcast_dimensions(argpairs, numblocks)
     {'i': 2, 'j': 3}
+
+    Works as well on the sizes of blocks along each axis
+
+    >>> blockdims = {'x': ((5, 5), (1,)), 'y': ((1,), (2, 2))}
+    >>> broadcast_dimensions(argpairs, blockdims)
+    {'i': (5, 5), 'j': (2, 2)}
     """
     # List like [('i', 2), ('j', 1), ('i', 1), ('j', 2)]
     L = concat([zip(inds, dims)
@@ -135,10 +220,28 @@ def broadcast_dimensions(argpairs, numblocks):
     g = groupby(0, L)
     g = dict((k, [d for i, d in v]) for k, v in g.items())
 
-    if not all(len(set(v) - set([1])) == 1 for v in g.values()):
+    if not all(len(set(v) - set([1, (1,)])) <= 1 for v in g.values()):
         raise ValueError("Shapes do not align %s" % g)
 
-    return valmap(max, g)
+    return valmap(consolidate_dimension, g)
+
+
+def consolidate_dimension(dims):
+    """ The dimension of a set of aligned dimensions, ignoring broadcasts
+
+    Dimensions may be block counts or sizes of blocks along an axis.
+
+    >>> consolidate_dimension([1, 3, 1])
+    3
+    >>> consolidate_dimension([(1,), (2, 2, 1)])
+    (2, 2, 1)
+    >>> consolidate_dimension([1, 1])
+    1
+    """
+    for d in dims:
+        if d != 1 and d != (1,):
+            return d
+    return dims[0]
 
 
 def top(func, output, out_indices, *arrind_pairs, **kwargs):
@@ -208,31 +311,121 @@ def top(func, output, out_indices, *arrind_pairs, **kwargs):
     # Dictionary mapping {i: 3, j: 4, ...} for i, j, ... the dimensions
     dims = broadcast_dimensions(argpairs, numblocks)
 
-    # (0, 0), (0, 1), (0, 2), (1, 0), ...
-    keytups = list(itertools.product(*[range(dims[i]) for i in out_indices]))
-    # {i: 0, j: 0}, {i: 0, j: 1}, ...
-    keydicts = [dict(zip(out_indices, tup)) for tup in keytups]
+    # Block coordinates of every output key, one column per output index
+    # {i: [0, 0, 1, 1], j: [0, 1, 0, 1]}
+    shape = [dims[i] for i in out_indices]
+    nkeys = int(np.prod(shape))
+    grid = np.indices(shape).reshape((len(shape), nkeys))
+    columns = dict(zip(out_indices, grid.tolist()))
 
     # {j: [1, 2, 3], ...}  For j a dummy index of dimension 3
     dummies = dict((i, list(range(dims[i]))) for i in dummy_indices)
 
-    # Create argument lists
-    valtups = []
-    for kd in keydicts:
-        args = []
-        for arg, ind in argpairs:
-            tups = lol_tuples((arg,), ind, kd, dummies)
-            tups2 = zero_broadcast_dimensions(tups, numblocks[arg])
-            args.append(tups2)
-        valtups.append(tuple(args))
+    # Create argument lists, one column per argument
+    argcolumns = []
+    for arg, ind in argpairs:
+        if not ind:
+            argcolumns.append([(arg,)] * nkeys)
+        elif not dummy_indices.intersection(ind):
+            # Broadcast along singleton dimensions
+            cols = [columns[i] if n != 1 else [0] * nkeys
+                    for i, n in zip(ind, numblocks[arg])]
+            argcolumns.append(list(zip(itertools.repeat(arg), *cols)))
+        else:
+            # Nested lists of keys along dummy indices
+            cache = dict()
+            col = []
+            for k in range(nkeys):
+                kd = dict((i, columns[i][k]) for i in ind if i in columns)
+                tup = tuple(sorted(kd.items()))
+                if tup not in cache:
+                    tups = lol_tuples((arg,), ind, kd, dummies)
+                    cache[tup] = zero_broadcast_dimensions(tups,
+                                                           numblocks[arg])
+                col.append(cache[tup])
+            argcolumns.append(col)
 
     # Add heads to tuples
-    keys = [(output,) + kt for kt in keytups]
-    vals = [(func,) + vt for vt in valtups]
+    if out_indices:
+        keys = zip(itertools.repeat(output), *[columns[i] for i in out_indices])
+    else:
+        keys = [(output,)]
+    vals = zip(itertools.repeat(func), *argcolumns)
 
     return dict(zip(keys, vals))
 
 
+class Top(Mapping):
+    """ Lazy dask of a tensor operation
+
+    Holds the arguments of ``top`` and generates tasks on demand rather than
+    building every task up front.
+
+    >>> inc = lambda x: x + 1
+    >>> t = Top(inc, 'z', 'ij', 'x', 'ij', numblocks={'x': (2, 2)})
+    >>> len(t)
+    4
+    >>> t[('z', 1, 0)]  # doctest: +SKIP
+    (inc, ('x', 1, 0))
+    >>> ('z', 2, 0) in t
+    False
+
+    Convert to a dict of all tasks with ``todict``
+
+    >>> t.todict() == top(inc, 'z', 'ij', 'x', 'ij', numblocks={'x': (2, 2)})
+    True
+
+    See Also
+    --------
+
+    top
+    """
+    def __init__(self, func, output, out_indices, *arrind_pairs, **kwargs):
+        self.func = func
+        self.output = output
+        self.out_indices = tuple(out_indices)
+        self.arrind_pairs = arrind_pairs
+        self.numblocks = kwargs['numblocks']
+        self.argpairs = list(partition(2, arrind_pairs))
+        self.dims = broadcast_dimensions(self.argpairs, self.numblocks)
+
+        all_indices = pipe(self.argpairs, pluck(1), concat, set)
+        dummy_indices = all_indices - set(out_indices)
+        self.dummies = dict((i, list(range(self.dims[i])))
+                            for i in dummy_indices)
+
+    @property
+    def shape(self):
+        return tuple(self.dims[i] for i in self.out_indices)
+
+    def __getitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        kd = dict(zip(self.out_indices, key[1:]))
+        args = [zero_broadcast_dimensions(
+                    lol_tuples((arg,), ind, kd, self.dummies),
+                    self.numblocks[arg])
+                for arg, ind in self.argpairs]
+        return (self.func,) + tuple(args)
+
+    def __contains__(self, key):
+        return (isinstance(key, tuple) and len(key) > 0
+                and key[0] == self.output
+                and len(key) == len(self.out_indices) + 1
+                and all(0 <= i < n for i, n in zip(key[1:], self.shape)))
+
+    def __iter__(self):
+        for tup in itertools.product(*[range(n) for n in self.shape]):
+            yield (self.output,) + tup
+
+    def __len__(self):
+        return int(np.prod(self.shape))
+
+    def todict(self):
+        return top(self.func, self.output, self.out_indices,
+                   *self.arrind_pairs, numblocks=self.numblocks)
+
+
 def concatenate2(arrays, axes=[]):
     """ Recursively Concatenate nested lists of arrays along axes
 
@@ -290,3 +483,633 @@ def concatenate(arrays, axis=0):
     if arrays[0].ndim <= axis:
         arrays = [a[None, ...] for a in arrays]
     return np.concatenate(arrays, axis=axis)
+
+
+def partial_reduce(func, x, numblocks, axes, out, split_every=4,
+                   keepdims=True):
+    """ Reduce groups of neighboring blocks along some axes
+
+    Apply ``func`` to nested lists of up to ``split_every`` neighboring blocks
+    along each of ``axes``.  The nesting follows the sorted order of ``axes``,
+    as in ``concatenate2``.
+
+    >>> partial_reduce(sum, 'x', (5,), (0,), 'y', split_every=2)  # doctest: +SKIP
+    {('y', 0): (sum, [('x', 0), ('x', 1)]),
+     ('y', 1): (sum, [('x', 2), ('x', 3)]),
+     ('y', 2): (sum, [('x', 4)])}
+
+    Drop the reduced axes from the output keys with ``keepdims=False``.  All
+    blocks along these axes must then fit in a single group.
+
+    >>> partial_reduce(sum, 'x', (2, 3), (1,), 'y', split_every=3,
+    ...                keepdims=False)  # doctest: +SKIP
+    {('y', 0): (sum, [('x', 0, 0), ('x', 0, 1), ('x', 0, 2)]),
+     ('y', 1): (sum, [('x', 1, 0), ('x', 1, 1), ('x', 1, 2)])}
+
+    See Also
+    --------
+
+    tree_reduce
+    """
+    axes = sorted(axes)
+    outblocks = [int(ceil(n / float(split_every))) if i in axes else n
+                 for i, n in enumerate(numblocks)]
+    if not keepdims and any(outblocks[i] != 1 for i in axes):
+        raise ValueError("Too many blocks to reduce at once, "
+                         "%s along axes %s" % (numblocks, axes))
+
+    def group(ind, axes):
+        """ Nested list of keys of the blocks in this group """
+        if not axes:
+            return (x,) + tuple(ind)
+        i = axes[0]
+        start = ind[i] * split_every
+        return [group(ind[:i] + [j] + ind[i+1:], axes[1:])
+                for j in range(start, min(start + split_every, numblocks[i]))]
+
+    dsk = dict()
+    for ind in itertools.product(*[range(n) for n in outblocks]):
+        if keepdims:
+            key = (out,) + ind
+        else:
+            key = (out,) + tuple(j for i, j in enumerate(ind) if i not in axes)
+        dsk[key] = (func, group(list(ind), axes))
+    return dsk
+
+
+def tree_reduce(combine, aggregate, x, numblocks, axes, out, split_every=4):
+    """ Reduce blocks along axes in a tree of tasks
+
+    Rather than hand all blocks along the reduced axes to a single task we
+    ``combine`` groups of ``split_every`` neighboring blocks level by level.
+    Both ``combine`` and ``aggregate`` receive nested lists of blocks.
+    ``combine`` must return a partial result like its inputs, keeping
+    dimensions.  ``aggregate`` produces the final result for the last group.
+
+    >>> dsk = tree_reduce(sum, sum, 'x', (5,), (0,), 'y', split_every=2)
+    >>> dsk[('y',)]  # doctest: +SKIP
+    (sum, [('y-partial-1', 0), ('y-partial-1', 1)])
+    >>> sorted(dsk)  # doctest: +NORMALIZE_WHITESPACE
+    [('y',),
+     ('y-partial-0', 0), ('y-partial-0', 1), ('y-partial-0', 2),
+     ('y-partial-1', 0), ('y-partial-1', 1)]
+
+    Returns a dask with output keys like ``x`` with the reduced axes dropped.
+
+    See Also
+    --------
+
+    partial_reduce
+    """
+    dsk = dict()
+    numblocks = tuple(numblocks)
+    level = 0
+    while any(numblocks[i] > split_every for i in axes):
+        name = '%s-partial-%d' % (out, level)
+        dsk.update(partial_reduce(combine, x, numblocks, axes, name,
+                                  split_every=split_every))
+        numblocks = tuple(int(ceil(n / float(split_every))) if i in axes else n
+                          for i, n in enumerate(numblocks))
+        x = name
+        level += 1
+    dsk.update(partial_reduce(aggregate, x, numblocks, axes, out,
+                              split_every=split_every, keepdims=False))
+    return dsk
+
+
+def moment_dtype(order=2):
+    """ Record type of partial moments up to some order
+
+    >>> moment_dtype(3).names
+    ('n', 'mean', 'M2', 'M3')
+    """
+    return np.dtype([('n', 'i8'), ('mean', 'f8')] +
+                    [('M%d' % p, 'f8') for p in range(2, order + 1)])
+
+
+def moment_chunk(x, axis=None, order=2):
+    """ Partial moments of a block
+
+    Returns a record array, keeping dimensions along ``axis``, of the count,
+    the mean and the sums of powers of deviations from that mean (``M2``,
+    ``M3``, ...).  We work in double precision regardless of input type.
+
+    >>> x = np.array([1, 2, 3, 4], dtype='f4')
+    >>> m = moment_chunk(x, axis=0)
+    >>> int(m['n'][0]), float(m['mean'][0]), float(m['M2'][0])
+    (4, 2.5, 5.0)
+
+    See Also
+    --------
+
+    moment_combine
+    moment_agg
+    """
+    if axis is None:
+        axis = tuple(range(x.ndim))
+    if isinstance(axis, int):
+        axis = (axis,)
+    axis = tuple(axis)
+    x = np.asarray(x, dtype='f8')
+    n = int(np.prod([x.shape[i] for i in axis]))
+    mean = x.mean(axis=axis, keepdims=True) if n else \
+           np.zeros([1 if i in axis else d for i, d in enumerate(x.shape)])
+
+    result = np.empty(mean.shape, dtype=moment_dtype(order))
+    result['n'] = n
+    result['mean'] = mean
+    d = x - mean
+    for p in range(2, order + 1):
+        result['M%d' % p] = (d ** p).sum(axis=axis, keepdims=True)
+    return result
+
+
+def binomial(n, k):
+    """ Binomial coefficient
+
+    >>> binomial(4, 2)
+    6
+    """
+    result = 1
+    for i in range(1, k + 1):
+        result = result * (n - k + i) // i
+    return result
+
+
+def moment_combine(parts, axis=None):
+    """ Merge partial moments along an axis
+
+    Uses the parallel form of Welford's update.  For each part ``i`` with
+    ``delta_i = mean_i - mean``
+
+        M_p = sum_i sum_k binomial(p, k) * M_(p-k),i * delta_i ** k
+
+    where ``M_0,i = n_i`` and ``M_1,i = 0``.  This avoids subtracting large
+    sums of squares from one another and so stays accurate.
+
+    >>> x = np.arange(10, dtype='f8')
+    >>> parts = np.concatenate([moment_chunk(x[:3], axis=0),
+    ...                         moment_chunk(x[3:], axis=0)])
+    >>> m = moment_combine(parts, axis=0)
+    >>> int(m['n'][0]), float(m['mean'][0]), float(m['M2'][0])
+    (10, 4.5, 82.5)
+    """
+    if axis is None:
+        axis = tuple(range(parts.ndim))
+    if isinstance(axis, int):
+        axis = (axis,)
+    axis = tuple(axis)
+    order = len(parts.dtype.names) - 1
+
+    n_i = parts['n']
+    n = n_i.sum(axis=axis, keepdims=True)
+    mean = (n_i * parts['mean']).sum(axis=axis, keepdims=True) \
+            / np.maximum(n, 1)
+    delta = np.where(n_i > 0, parts['mean'] - mean, 0)
+
+    def M(p):
+        if p == 0:
+            return n_i
+        if p == 1:
+            return 0
+        return parts['M%d' % p]
+
+    result = np.empty(n.shape, dtype=parts.dtype)
+    result['n'] = n
+    result['mean'] = mean
+    for p in range(2, order + 1):
+        result['M%d' % p] = sum(binomial(p, k) * M(p - k) * delta ** k
+                                for k in range(0, p + 1)
+                                ).sum(axis=axis, keepdims=True)
+    return result
+
+
+def moment_agg(parts, axis=None, stat='var', ddof=0, order=2):
+    """ Final statistic from partial moments
+
+    ``stat`` is one of ``'mean'``, ``'var'``, ``'std'`` or ``'moment'``, the
+    central moment of some ``order``.
+
+    >>> x = np.arange(10, dtype='f8')
+    >>> parts = np.concatenate([moment_chunk(x[:3], axis=0),
+    ...                         moment_chunk(x[3:], axis=0)])
+    >>> float(moment_agg(parts, axis=0, stat='var', ddof=1))
+    9.166666666666666
+    """
+    if axis is None:
+        axis = tuple(range(parts.ndim))
+    if isinstance(axis, int):
+        axis = (axis,)
+    m = moment_combine(parts, axis=axis)
+    m = m.reshape(tuple(d for i, d in enumerate(m.shape) if i not in axis))
+    if not m.ndim:
+        m = m[()]
+    if stat == 'mean':
+        return m['mean']
+    if stat == 'moment':
+        return m['M%d' % order] / m['n']
+    var = m['M2'] / (m['n'] - ddof)
+    if stat == 'var':
+        return var
+    if stat == 'std':
+        return np.sqrt(var)
+    raise ValueError("Unknown statistic %s" % stat)
+
+
+def blockdims_from_blockshape(shape, blockshape):
+    """ Sizes of the blocks along each axis
+
+    >>> blockdims_from_blockshape((10, 10), (4, 3))
+    ((4, 4, 2), (3, 3, 3, 1))
+    """
+    return tuple((bd,) * (d // bd) + ((d % bd,) if d % bd else ())
+                 for d, bd in zip(shape, blockshape))
+
+
+def rechunk_pieces(old, new):
+    """ Pieces of old blocks that make up each new block along one axis
+
+    Returns a list, one entry per new block, of ``(old index, slice)`` pairs
+
+    >>> rechunk_pieces((4, 4, 2), (5, 5))  # doctest: +NORMALIZE_WHITESPACE
+    [[(0, slice(0, 4, None)), (1, slice(0, 1, None))],
+     [(1, slice(1, 4, None)), (2, slice(0, 2, None))]]
+    """
+    old_bounds = np.cumsum(old).tolist()
+    pieces = []
+    start = 0
+    i = 0
+    for n in new:
+        stop = start + n
+        result = []
+        while start < stop:
+            old_start = old_bounds[i] - old[i]
+            end = min(stop, old_bounds[i])
+            result.append((i, slice(start - old_start, end - old_start)))
+            start = end
+            if end == old_bounds[i]:
+                i += 1
+        pieces.append(result)
+    return pieces
+
+
+def rechunk(x, out, old_blockdims, new_blockdims):
+    """ Dask to change the blocks of array ``x`` into new blocks ``out``
+
+    Each new block slices the pieces it needs out of old blocks and
+    concatenates them.  Blocks that come from a single old block are just a
+    slice.
+
+    >>> rechunk('x', 'y', ((2, 2),), ((4,),))  # doctest: +SKIP
+    {('y-split', 0, 0): (getitem, ('x', 0), (slice(0, 2),)),
+     ('y-split', 0, 1): (getitem, ('x', 1), (slice(0, 2),)),
+     ('y', 0): (concatenate2, [('y-split', 0, 0), ('y-split', 0, 1)])}
+
+    The slices are ``getitem`` tasks, which ``dask.obj.get`` inlines.  New
+    blocks then read straight from source blocks on disk, so only a few blocks
+    are in memory at once.
+    """
+    pieces = [rechunk_pieces(o, n)
+              for o, n in zip(old_blockdims, new_blockdims)]
+    split = '%s-split' % out
+    ndim = len(pieces)
+    concat = partial(concatenate2, axes=list(range(ndim)))
+
+    dsk = dict()
+    for new_ind in itertools.product(*[range(len(n)) for n in new_blockdims]):
+        parts = [pieces[d][i] for d, i in enumerate(new_ind)]
+        if all(len(p) == 1 for p in parts):
+            old_ind = tuple(p[0][0] for p in parts)
+            dsk[(out,) + new_ind] = (operator.getitem, (x,) + old_ind,
+                                     tuple(p[0][1] for p in parts))
+            continue
+
+        def nest(d, old_ind, slices):
+            """ Nested list of keys of pieces, splitting along axis d """
+            if d == ndim:
+                key = (split,) + new_ind + old_ind
+                dsk[key] = (operator.getitem, (x,) + old_ind, slices)
+                return key
+            return [nest(d + 1, old_ind + (i,), slices + (s,))
+                    for i, s in parts[d]]
+
+        dsk[(out,) + new_ind] = (concat, nest(0, (), ()))
+    return dsk
+
+
+def slice_pieces(index, blockdim):
+    """ Pieces of blocks selected by an index along one axis
+
+    Returns a list of ``(block, local index, size)`` in output order, where
+    ``size`` is None for integer indices, which drop the axis.
+
+    >>> slice_pieces(slice(3, 12, 2), (5, 5, 5))
+    [(0, slice(3, 5, 2), 1), (1, slice(0, 5, 2), 3), (2, slice(1, 2, 2), 1)]
+    >>> slice_pieces(7, (5, 5, 5))
+    [(1, 2, None)]
+    >>> slice_pieces(slice(None, None, -4), (5, 5))
+    [(1, slice(4, None, -4), 2), (0, slice(1, None, -4), 1)]
+    """
+    starts = np.cumsum((0,) + tuple(blockdim)).tolist()
+    dim = starts[-1]
+    if isinstance(index, (int, np.integer)):
+        i = index + dim if index < 0 else index
+        if not 0 <= i < dim:
+            raise IndexError("Index %d out of bounds for axis of size %d"
+                             % (index, dim))
+        b = int(np.searchsorted(starts, i, side='right')) - 1
+        return [(b, i - starts[b], None)]
+
+    start, stop, step = index.indices(dim)
+    pieces = []
+    if step > 0:
+        for b in range(len(blockdim)):
+            lo, hi = max(start, starts[b]), min(stop, starts[b + 1])
+            first = start + -(-(lo - start) // step) * step
+            if first < hi:
+                n = -(-(hi - first) // step)
+                pieces.append((b, slice(first - starts[b], hi - starts[b],
+                                        step), n))
+    else:
+        for b in reversed(range(len(blockdim))):
+            hi, lo = min(start, starts[b + 1] - 1), max(stop, starts[b] - 1)
+            first = start - -(-(start - hi) // -step) * -step
+            if first > lo:
+                n = -(-(first - lo) // -step)
+                end = lo - starts[b]
+                pieces.append((b, slice(first - starts[b],
+                                        end if end >= 0 else None, step), n))
+    if not pieces and blockdim:  # Empty selection, keep an empty block
+        pieces.append((0, slice(0, 0), 0))
+    return pieces
+
+
+def slice_array(out, x, blockdims, index):
+    """ Dask to slice the array ``x`` with blocks of sizes ``blockdims``
+
+    Supports integers, slices with steps, ``None`` and ``Ellipsis``.  We only
+    touch the blocks that overlap the selection.  Returns the dask and the
+    blockdims of the result.
+
+    >>> dsk, bd = slice_array('y', 'x', ((5, 5), (5, 5)), (slice(2, 4), 7))
+    >>> dsk  # doctest: +SKIP
+    {('y', 0): (getitem, ('x', 0, 1), (slice(2, 4, 1), 2))}
+    >>> bd
+    ((2,),)
+    """
+    if not isinstance(index, tuple):
+        index = (index,)
+    if any(i is Ellipsis for i in index):
+        n = index.index(Ellipsis)
+        fill = len(blockdims) - (len(index) - 1 - index.count(None))
+        index = index[:n] + (slice(None),) * fill + index[n + 1:]
+    ndim = len(index) - index.count(None)
+    if ndim > len(blockdims):
+        raise IndexError("Too many indices for array")
+    index = index + (slice(None),) * (len(blockdims) - ndim)
+    for i in index:
+        if not (i is None or isinstance(i, (int, np.integer, slice))):
+            raise NotImplementedError("Slicing with %s not supported"
+                                      % type(i).__name__)
+
+    axes = []  # per output position: list of (block, local index, size)
+    dims = iter(blockdims)
+    for i in index:
+        if i is None:
+            axes.append([(None, None, 1)])
+        else:
+            axes.append(slice_pieces(i, next(dims)))
+
+    dsk = dict()
+    for combo in itertools.product(*[enumerate(a) for a in axes]):
+        out_ind = tuple(j for j, (b, ind, n) in combo if n is not None)
+        in_ind = tuple(b for j, (b, ind, n) in combo if b is not None)
+        dsk[(out,) + out_ind] = (operator.getitem, (x,) + in_ind,
+                                 tuple(ind for j, (b, ind, n) in combo))
+
+    new_blockdims = tuple(tuple(n for b, ind, n in a)
+                          for a in axes if a[0][2] is not None)
+    return dsk, new_blockdims
+
+
+def getitem_axes(x, index):
+    """ Index one axis at a time
+
+    Unlike ``x[index]``, lists along several axes select an outer product.
+
+    >>> x = np.arange(6).reshape((2, 3))
+    >>> getitem_axes(x, ([0, 0], [2, 2]))
+    array([[2, 2],
+           [2, 2]])
+    """
+    for i, ind in enumerate(index):
+        x = x[(slice(None),) * i + (ind,)]
+    return x
+
+
+def constant_slab(x, index, value):
+    """ Array like ``getitem_axes(x, index)`` full of ``value``
+
+    >>> constant_slab(np.arange(6).reshape((2, 3)), ([0], [1, 2]), 7)
+    array([[7, 7]])
+    """
+    out = np.empty_like(getitem_axes(x, index))
+    out.fill(value)
+    return out
+
+
+boundary_modes = ('reflect', 'periodic', 'nearest', 'none')
+
+
+def normalize_ghost(ndim, depth, boundary):
+    """ Depth and boundary per axis
+
+    >>> normalize_ghost(2, 1, 'reflect')
+    ((1, 1), ('reflect', 'reflect'))
+    >>> normalize_ghost(2, {1: 2}, {1: 0})
+    ((0, 2), ('reflect', 0))
+    """
+    if isinstance(depth, dict):
+        depth = tuple(depth.get(i, 0) for i in range(ndim))
+    elif not isinstance(depth, (tuple, list)):
+        depth = (depth,) * ndim
+    if isinstance(boundary, dict):
+        boundary = tuple(boundary.get(i, 'reflect') for i in range(ndim))
+    elif not isinstance(boundary, (tuple, list)):
+        boundary = (boundary,) * ndim
+    for b in boundary:
+        if isinstance(b, str) and b not in boundary_modes:
+            raise ValueError("Unknown boundary %s, expected a number or one "
+                             "of %s" % (b, boundary_modes))
+    return tuple(depth), tuple(boundary)
+
+
+def ghost_sources(n, d, mode):
+    """ Where the slabs come from, before and after each block along an axis
+
+    Returns, for each of ``n`` blocks, a list of ``(offset, block, index)``
+    for offsets -1, 0 and 1, where ``index`` indexes into ``block``.  Slabs
+    of constant boundaries come from the block itself, to be filled later.
+    With ``'none'`` we add nothing at the edges of the array.
+
+    >>> ghost_sources(2, 1, 'periodic')  # doctest: +NORMALIZE_WHITESPACE
+    [[(-1, 1, slice(-1, None, None)), (0, 0, slice(None, None, None)),
+      (1, 1, slice(0, 1, None))],
+     [(-1, 0, slice(-1, None, None)), (0, 1, slice(None, None, None)),
+      (1, 0, slice(0, 1, None))]]
+    """
+    result = []
+    for i in range(n):
+        sources = []
+        if d:
+            if i > 0:
+                sources.append((-1, i - 1, slice(-d, None)))
+            elif mode == 'periodic':
+                sources.append((-1, n - 1, slice(-d, None)))
+            elif mode == 'reflect':
+                sources.append((-1, i, slice(d - 1, None, -1)))
+            elif mode == 'nearest':
+                sources.append((-1, i, [0] * d))
+            elif mode != 'none':  # constant
+                sources.append((-1, i, slice(0, d)))
+        sources.append((0, i, slice(None)))
+        if d:
+            if i < n - 1:
+                sources.append((1, i + 1, slice(0, d)))
+            elif mode == 'periodic':
+                sources.append((1, 0, slice(0, d)))
+            elif mode == 'reflect':
+                sources.append((1, i, slice(-1, -d - 1, -1)))
+            elif mode == 'nearest':
+                sources.append((1, i, [-1] * d))
+            elif mode != 'none':
+                sources.append((1, i, slice(-d, None)))
+        result.append(sources)
+    return result
+
+
+def ghost(x, out, blockdims, depth, boundary='reflect'):
+    """ Dask of blocks extended by slabs of their neighbors
+
+    Each block of ``out`` holds its block of ``x`` with ``depth`` more
+    elements on either side along each axis, taken from neighboring blocks.
+    At the edges of the array we fill in according to ``boundary``
+
+    *   ``'reflect'``: mirror the block, including its edge value
+    *   ``'periodic'``: wrap around to the other side of the array
+    *   ``'nearest'``: repeat the edge value
+    *   ``'none'``: add nothing
+    *   a number: that constant
+
+    ``depth`` and ``boundary`` may also be dicts or tuples, one per axis.
+    Returns the dask and the blockdims of ``out``.
+
+    >>> dsk, bd = ghost('x', 'y', ((4, 4),), 1, 'none')
+    >>> bd
+    ((5, 5),)
+    >>> dsk[('y', 0)]  # doctest: +SKIP
+    (concatenate2, [('y-slab', 0, 0), ('y-slab', 0, 1)])
+
+    See Also
+    --------
+
+    trim
+    """
+    ndim = len(blockdims)
+    depth, boundary = normalize_ghost(ndim, depth, boundary)
+    for d, bd in zip(depth, blockdims):
+        if bd and d > min(bd):
+            raise ValueError("Depth %d larger than smallest block %d"
+                             % (d, min(bd)))
+    sources = [ghost_sources(len(bd), d, b)
+               for bd, d, b in zip(blockdims, depth, boundary)]
+    slab = '%s-slab' % out
+    concat = partial(concatenate2, axes=list(range(ndim)))
+
+    dsk = dict()
+    for ind in itertools.product(*[range(len(bd)) for bd in blockdims]):
+        def nest(k, offsets, block, index, constant):
+            if k == ndim:
+                if constant is None:
+                    task = (getitem_axes, (x,) + block, index)
+                else:
+                    task = (constant_slab, (x,) + block, index, constant)
+                key = (slab,) + ind + offsets
+                dsk[key] = task
+                return key
+            result = []
+            for offset, b, i in sources[k][ind[k]]:
+                c = constant
+                if (offset != 0 and b == ind[k] and
+                        not isinstance(boundary[k], str)):
+                    c = boundary[k]
+                result.append(nest(k + 1, offsets + (offset,), block + (b,),
+                                   index + (i,), c))
+            return result
+
+        dsk[(out,) + ind] = (concat, nest(0, (), (), (), None))
+
+    new_blockdims = tuple(tuple(n + d * (len(s) - 1) for n, s in zip(bd, src))
+                          for bd, d, src in zip(blockdims, depth, sources))
+    return dsk, new_blockdims
+
+
+def trim(x, out, blockdims, depth, boundary='reflect'):
+    """ Dask to trim the slabs added by ``ghost``
+
+    ``blockdims``, ``depth`` and ``boundary`` are those given to ``ghost``.
+
+    >>> trim('y', 'z', ((4, 4),), 1, 'none')  # doctest: +SKIP
+    {('z', 0): (getitem, ('y', 0), (slice(0, 4),)),
+     ('z', 1): (getitem, ('y', 1), (slice(1, 5),))}
+    """
+    depth, boundary = normalize_ghost(len(blockdims), depth, boundary)
+    sources = [ghost_sources(len(bd), d, b)
+               for bd, d, b in zip(blockdims, depth, boundary)]
+
+    def axis_slice(k, i):
+        before = depth[k] if sources[k][i][0][0] == -1 else 0
+        return slice(before, before + blockdims[k][i])
+
+    return dict(((out,) + ind,
+                 (operator.getitem, (x,) + ind,
+                  tuple(axis_slice(k, i) for k, i in enumerate(ind))))
+                for ind in itertools.product(*[range(len(bd))
+                                               for bd in blockdims]))
+
+
+def cumulative(func, binop, x, out, numblocks, axis):
+    """ Dask of a cumulative reduction, like ``np.cumsum``, along an axis
+
+    Every block scans itself with ``func`` in parallel.  We then carry the
+    totals of earlier blocks along ``axis`` in a short sequential chain of
+    tasks on slabs one element thick, and combine them into each block with
+    ``binop``.
+
+    >>> dsk = cumulative(np.cumsum, operator.add, 'x', 'y', (3,), 0)
+    >>> dsk[('y', 2)]  # doctest: +SKIP
+    (add, ('y-scan', 2), ('y-carry', 2))
+    >>> dsk[('y-carry', 2)]  # doctest: +SKIP
+    (add, ('y-carry', 1), (getitem, ('y-scan', 1), (slice(-1, None),)))
+    """
+    scan = '%s-scan' % out
+    carry = '%s-carry' % out
+    last = tuple(slice(-1, None) if i == axis else slice(None)
+                 for i in range(len(numblocks)))
+    func = partial(func, axis=axis)
+
+    dsk = dict()
+    for ind in itertools.product(*[range(n) for n in numblocks]):
+        dsk[(scan,) + ind] = (func, (x,) + ind)
+        i = ind[axis]
+        if i == 0:
+            dsk[(out,) + ind] = (operator.getitem, (scan,) + ind, Ellipsis)
+            continue
+        prev = ind[:axis] + (i - 1,) + ind[axis + 1:]
+        total = (operator.getitem, (scan,) + prev, last)
+        if i == 1:
+            dsk[(carry,) + ind] = total
+        else:
+            dsk[(carry,) + ind] = (binop, (carry,) + prev, total)
+        dsk[(out,) + ind] = (binop, (scan,) + ind, (carry,) + ind)
+    return dsk
@@ -0,0 +1,172 @@
+"""
+Store blocked arrays on disk, one compressed file per block
+
+A store is a directory holding a ``meta.json`` file, with the shape, sizes of
+blocks along each axis, dtype and compression of the array, and one file per
+block, named by the block's index, e.g. ``1.0`` for the block at ``(1, 0)``.
+
+Each block is its own file so we read and write blocks in parallel without
+any locks.  Compression (``zlib``, or ``lz4`` where installed) and file I/O
+both release the GIL so this scales with threads.
+
+>>> import tempfile, shutil
+>>> path = tempfile.mkdtemp()
+>>> x = np.arange(6).reshape((2, 3))
+>>> write_metadata(path, x.shape, (1, 3), x.dtype)
+>>> write_block(path, x[:1], (0, 0))
+>>> write_block(path, x[1:], (1, 0))
+>>> dsk, meta = load_dask(path, 'x')
+>>> from dask.threaded import get
+>>> get(dsk, ('x', 1, 0))
+array([[3, 4, 5]])
+>>> shutil.rmtree(path)
+"""
+import os
+import json
+import zlib
+import itertools
+from functools import partial
+import numpy as np
+from .array import blockdims_from_blockshape
+
+try:
+    import lz4
+    lz4_compress, lz4_decompress = lz4.compress, lz4.decompress
+except (ImportError, AttributeError):
+    try:
+        import lz4.block
+        lz4_compress, lz4_decompress = lz4.block.compress, lz4.block.decompress
+    except ImportError:
+        lz4 = None
+
+
+def zlib_compress(data):
+    return zlib.compress(data, 1)
+
+
+compressors = {'zlib': (zlib_compress, zlib.decompress),
+               None: (bytes, bytes)}
+if lz4:
+    compressors['lz4'] = (lz4_compress, lz4_decompress)
+
+default_compression = 'lz4' if lz4 else 'zlib'
+
+
+def block_filename(path, index):
+    """ Name of the file holding the block at ``index``
+
+    >>> block_filename('/data', (1, 0))  # doctest: +SKIP
+    '/data/1.0'
+    """
+    return os.path.join(path, '.'.join(map(str, index)) or 'block')
+
+
+def dtype_to_json(dtype):
+    """ JSON-able description of a dtype
+
+    >>> dtype_to_json(np.dtype('i4'))
+    '<i4'
+    >>> dtype_to_json(np.dtype([('a', 'i4'), ('b', 'f8')]))
+    [['a', '<i4'], ['b', '<f8']]
+    """
+    if dtype.names:
+        return [list(field) for field in dtype.descr]
+    return dtype.str
+
+
+def dtype_from_json(o):
+    """ Inverse of ``dtype_to_json``
+
+    >>> dtype_from_json([['a', '<i4'], ['b', '<f8']])
+    dtype([('a', '<i4'), ('b', '<f8')])
+    """
+    if not isinstance(o, list):
+        return np.dtype(str(o))
+    fields = []
+    for field in o:
+        name, dt = str(field[0]), field[1]
+        dt = dtype_from_json(dt) if isinstance(dt, list) else str(dt)
+        fields.append((name, dt) + tuple(tuple(shape) for shape in field[2:]))
+    return np.dtype(fields)
+
+
+def write_metadata(path, shape, blockdims, dtype,
+                   compression=default_compression):
+    """ Create a store at ``path`` for an array of this shape and dtype
+
+    ``blockdims`` holds the sizes of blocks along each axis, or a single
+    blockshape
+    """
+    if not os.path.exists(path):
+        os.makedirs(path)
+    if not any(isinstance(bd, (tuple, list)) for bd in blockdims):
+        blockdims = blockdims_from_blockshape(shape, blockdims)
+    meta = {'shape': list(shape),
+            'blockdims': [list(bd) for bd in blockdims],
+            'dtype': dtype_to_json(np.dtype(dtype)),
+            'compression': compression}
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+
+
+def read_metadata(path):
+    """ Shape, blockdims, dtype and compression of the store at ``path`` """
+    with open(os.path.join(path, 'meta.json')) as f:
+        meta = json.load(f)
+    return {'shape': tuple(meta['shape']),
+            'blockdims': tuple(map(tuple, meta['blockdims'])),
+            'dtype': dtype_from_json(meta['dtype']),
+            'compression': meta['compression']}
+
+
+def write_block(path, x, index, compression=default_compression):
+    """ Compress and write one block to its own file """
+    compress = compressors[compression][0]
+    data = compress(np.ascontiguousarray(x).tobytes())
+    with open(block_filename(path, index), 'wb') as f:
+        f.write(data)
+    return None
+
+
+def read_block(path, index, shape, dtype, compression=default_compression):
+    """ Read and decompress one block
+
+    The result is a read-only view onto the decompressed bytes.
+    """
+    decompress = compressors[compression][1]
+    with open(block_filename(path, index), 'rb') as f:
+        data = decompress(f.read())
+    return np.frombuffer(data, dtype=dtype).reshape(shape)
+
+
+def store_dask(path, name, out, numblocks, compression=default_compression):
+    """ Dask to write each block of the array ``name`` to the store at ``path``
+
+    One task per block, each writing its own file
+
+    >>> store_dask('/data', 'x', 'store-x', (2,))  # doctest: +SKIP
+    {('store-x', 0): (write_block, ('x', 0), (0,)),
+     ('store-x', 1): (write_block, ('x', 1), (1,))}
+    """
+    write = partial(write_block, path, compression=compression)
+    return dict(((out,) + index, (write, (name,) + index, index))
+                for index in itertools.product(*map(range, numblocks)))
+
+
+def load_dask(path, name):
+    """ Dask to read every block of the store at ``path``
+
+    The key ``name`` holds the path, as the array does in ``getem`` dasks.
+    Returns the dask and the metadata of the store.
+    """
+    meta = read_metadata(path)
+    blockdims = meta['blockdims']
+    read = partial(read_block, dtype=meta['dtype'],
+                   compression=meta['compression'])
+    dsk = dict(((name,) + index,
+                (read, name, index,
+                 tuple(bd[i] for i, bd in zip(index, blockdims))))
+               for index in itertools.product(*[range(len(bd))
+                                                for bd in blockdims]))
+    dsk[name] = path
+    return dsk, meta
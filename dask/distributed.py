@@ -0,0 +1,382 @@
+"""
+A scheduler and workers that communicate over sockets
+
+This code is experimental.  It runs dasks on several worker processes on the
+local machine, escaping both the GIL and the memory space of a single process.
+
+Workers
+-------
+
+Each worker is a separate process that listens on a TCP or Unix socket.  It
+holds its own data in a dictionary and serves the following requests
+
+1.  ``('put', key, value)``: store data
+2.  ``('get', key)``: send data back, to the scheduler or to another worker
+3.  ``('compute', key, task, locations)``: compute a task and store the result.
+    ``locations`` is a dictionary ``{dep: address}`` telling the worker where
+    to find the inputs of this task.  Inputs held by other workers move
+    directly from those workers, peer to peer.
+4.  ``('delete', keys)``: release data
+5.  ``('keys',)``: list the keys of all held data
+6.  ``('close',)``: shut down
+
+A request that fails on the worker returns ``('error', exception)``, which
+``request`` raises.
+
+Scheduler
+---------
+
+The scheduler reuses the state machine of the ``threaded`` scheduler.  Rather
+than hold data in its ``cache`` it holds the address of the worker that holds
+that data.  When the state machine releases data we tell the worker to delete
+it.
+
+We send each task to a worker with a free slot, preferring the worker that
+already holds the most bytes of that task's inputs.
+"""
+from multiprocessing.connection import Listener, Client
+from multiprocessing import Process, Pipe, AuthenticationError, current_process
+from multiprocessing.pool import ThreadPool
+from threading import Thread, Lock
+import socket
+from collections import defaultdict
+import sys
+import psutil
+from .compatibility import Queue
+from .core import flatten
+from .threaded import (start_state_from_dask, finish_task, choose_task,
+        _execute_task, nested_get)
+
+
+def request(address, msg):
+    """ Send a message to a worker and wait for its response
+
+    Raises the worker's exception if the request failed there
+    """
+    conn = Client(address, authkey=current_process().authkey)
+    if isinstance(address, tuple):
+        # Don't hold our message back until the last handshake message is
+        # acknowledged, see Nagle's algorithm
+        sock = socket.fromfd(conn.fileno(), socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.close()
+    try:
+        conn.send(msg)
+        response = conn.recv()
+    finally:
+        conn.close()
+    if iserror(response):
+        raise response[1]
+    return response
+
+
+def iserror(response):
+    """ Is this response a failure, ``('error', exception)``?
+
+    >>> iserror(('error', KeyError('x')))
+    True
+    >>> iserror(('error', 'some data'))
+    False
+    """
+    return (type(response) is tuple and len(response) == 2
+            and response[0] == 'error' and isinstance(response[1], Exception))
+
+
+def nbytes(x):
+    """ Approximate number of bytes in an object
+
+    >>> import numpy as np
+    >>> nbytes(np.ones(10, dtype='i4'))
+    40
+    >>> nbytes(1)
+    1
+    """
+    return getattr(x, 'nbytes', 1)
+
+
+class Worker(object):
+    """ Hold data and compute tasks at the request of a scheduler
+
+    Each connection is served in its own thread so that peers may fetch data
+    while we compute.
+
+    See Also:
+        run_worker
+    """
+    def __init__(self, family='AF_INET'):
+        # Only processes that share our authkey, e.g. forked from the same
+        # parent, may connect; we unpickle whatever they send.  Connections
+        # queue while we authenticate another, so allow a long queue.
+        kwargs = {'family': family, 'backlog': 128,
+                  'authkey': current_process().authkey}
+        if family == 'AF_INET':
+            self.listener = Listener(('localhost', 0), **kwargs)
+        else:
+            self.listener = Listener(**kwargs)
+        self.address = self.listener.address
+        self.data = dict()
+        self.running = True
+
+    def serve_forever(self):
+        while self.running:
+            try:
+                conn = self.listener.accept()
+            except AuthenticationError:
+                continue
+            if not self.running:
+                conn.close()
+                break
+            t = Thread(target=self.handle, args=(conn,))
+            t.daemon = True
+            t.start()
+        self.listener.close()
+
+    def handle(self, conn):
+        """ Serve requests on one connection until it closes """
+        while True:
+            try:
+                msg = conn.recv()
+            except EOFError:
+                break
+            try:
+                response = getattr(self, msg[0])(*msg[1:])
+            except Exception as e:
+                response = ('error', e)
+            conn.send(response)
+            if msg[0] == 'close':
+                # Wake up the accepting thread
+                Client(self.address,
+                       authkey=current_process().authkey).close()
+                break
+        conn.close()
+
+    def put(self, key, value):
+        self.data[key] = value
+        return ('OK', nbytes(value))
+
+    def get(self, key):
+        return self.data[key]
+
+    def compute(self, key, task, locations):
+        cache = dict()
+        for dep, address in locations.items():
+            if address == self.address:
+                cache[dep] = self.data[dep]
+            else:
+                cache[dep] = request(address, ('get', dep))
+        result = _execute_task(task, cache)
+        self.data[key] = result
+        return ('OK', nbytes(result))
+
+    def delete(self, keys):
+        for key in keys:
+            self.data.pop(key, None)
+        return ('OK',)
+
+    def keys(self):
+        return list(self.data)
+
+    def close(self):
+        self.running = False
+        return ('OK',)
+
+
+def run_worker(conn, family='AF_INET'):
+    """ Start a worker, report its address back along ``conn`` """
+    worker = Worker(family=family)
+    conn.send(worker.address)
+    conn.close()
+    worker.serve_forever()
+
+
+def start_worker(family='AF_INET'):
+    """ Start a worker in a new process
+
+    Returns the worker's address and process
+    """
+    parent, child = Pipe()
+    p = Process(target=run_worker, args=(child, family))
+    p.daemon = True
+    p.start()
+    address = parent.recv()
+    parent.close()
+    return address, p
+
+
+class Locations(dict):
+    """ Cache of data locations, remembers data to delete from workers
+
+    Used as the ``cache`` of the scheduler state.  Values are worker
+    addresses rather than data.
+    """
+    def __init__(self, *args, **kwargs):
+        dict.__init__(self, *args, **kwargs)
+        self.released = []
+
+    def __delitem__(self, key):
+        self.released.append((key, self[key]))
+        dict.__delitem__(self, key)
+
+
+def delete(locations):
+    """ Delete keys from workers given a list of (key, address) pairs """
+    keys = defaultdict(list)
+    for key, address in locations:
+        keys[address].append(key)
+    for address, ks in keys.items():
+        request(address, ('delete', ks))
+
+
+def choose_worker(deps, state, addresses, load, sizes):
+    """ Choose the free worker that holds the most bytes of our inputs
+
+    >>> state = {'cache': {'x': 'alice', 'y': 'bob'}}
+    >>> sizes = {'x': 100, 'y': 10}
+    >>> choose_worker(['x', 'y'], state, ['alice', 'bob'], {'alice': 0, 'bob': 0}, sizes)
+    'alice'
+
+    Break ties by load
+
+    >>> choose_worker([], state, ['alice', 'bob'], {'alice': 1, 'bob': 0}, sizes)
+    'bob'
+    """
+    def local_bytes(address):
+        return sum(sizes.get(dep, 0) for dep in deps
+                    if state['cache'][dep] == address)
+    return max(addresses, key=lambda a: (local_bytes(a), -load[a]))
+
+
+def get(dsk, result, addresses, nthreads=1, **kwargs):
+    """ Distributed implementation of dask.get
+
+    Parameters
+    ----------
+
+    dsk: dict
+        A dask dictionary specifying a workflow
+    result: key or list of keys
+        Keys corresponding to desired data
+    addresses: list
+        Addresses of running workers, see ``start_worker``
+    nthreads: integer
+        The number of tasks to run at once on each worker
+
+    Examples
+    --------
+
+    >>> from operator import add
+    >>> with Cluster(2) as c:  # doctest: +SKIP
+    ...     get({'x': 1, 'y': (add, 'x', 1)}, 'y', c.addresses)
+    2
+    """
+    if isinstance(result, list):
+        result_flat = set(flatten(result))
+    else:
+        result_flat = set([result])
+    results = set(result_flat)
+
+    state = start_state_from_dask(dsk, cache=Locations())
+
+    if not state['ready']:
+        raise ValueError("Found no accessible jobs in dask")
+
+    load = dict((a, 0) for a in addresses)
+    sizes = dict()
+
+    # Scatter source data among the workers
+    for i, key in enumerate(list(state['cache'])):
+        address = addresses[i % len(addresses)]
+        _, sizes[key] = request(address, ('put', key, state['cache'][key]))
+        state['cache'][key] = address
+
+    pool = ThreadPool(nthreads * len(addresses))
+    queue = Queue()
+    lock = Lock()
+
+    def execute_task(key, address, locations):
+        """ Compute task on a remote worker and handle all administration """
+        try:
+            response = request(address, ('compute', key, dsk[key],
+                                         locations))
+            with lock:
+                sizes[key] = response[1]
+                load[address] -= 1
+                finish_task(dsk, key, address, state, results)
+            queue.put((key, None, None))
+        except Exception as e:
+            queue.put((key, e, sys.exc_info()[2]))
+
+    def fire_tasks():
+        """ Fire off tasks to workers with free slots """
+        while state['ready']:
+            free = [a for a in addresses if load[a] < nthreads]
+            if not free:
+                break
+            key = choose_task(state)
+            deps = state['dependencies'][key]
+            address = choose_worker(deps, state, free, load, sizes)
+            locations = dict((dep, state['cache'][dep]) for dep in deps)
+            state['ready'].remove(key)
+            state['running'].add(key)
+            load[address] += 1
+            pool.apply_async(execute_task, args=(key, address, locations))
+
+    try:
+        with lock:
+            fire_tasks()
+
+        # Main loop, wait on tasks to finish, insert new ones
+        while state['waiting'] or state['ready'] or state['running']:
+            key, err, tb = queue.get()
+            if err is not None:
+                import traceback
+                traceback.print_tb(tb)
+                raise err
+            with lock:
+                fire_tasks()
+                released = state['cache'].released
+                state['cache'].released = []
+            delete(released)
+
+        data = dict((key, request(state['cache'][key], ('get', key)))
+                    for key in result_flat)
+    finally:
+        pool.close()
+        pool.join()
+        # Clean up all data still held on workers
+        cache = state['cache']
+        delete(list(cache.released) + list(cache.items()))
+
+    return nested_get(result, data)
+
+
+class Cluster(object):
+    """ Several worker processes on the local machine
+
+    >>> from operator import add
+    >>> with Cluster(2) as c:  # doctest: +SKIP
+    ...     c.get({'x': 1, 'y': (add, 'x', 1)}, 'y')
+    2
+
+    See Also:
+        get
+    """
+    def __init__(self, nworkers=psutil.NUM_CPUS, family='AF_INET'):
+        workers = [start_worker(family=family) for i in range(nworkers)]
+        self.addresses = [a for a, p in workers]
+        self.processes = [p for a, p in workers]
+
+    def get(self, dsk, result, **kwargs):
+        return get(dsk, result, self.addresses, **kwargs)
+
+    def close(self):
+        for address in self.addresses:
+            request(address, ('close',))
+        for p in self.processes:
+            p.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,280 @@
+"""
+Dasks built from layers of tasks
+
+Array operations like ``atop`` each add many similar tasks to a dask.  If every
+operation copies the dasks of its inputs into a new dict then building a long
+chain of operations costs time quadratic in its length and holds every task
+in memory as tuples.
+
+Instead we keep a ``LayeredDask``, a mapping of named layers, each a mapping
+of tasks.  A layer may be a plain dict or something lazy like
+``dask.array.Top`` that produces its tasks on demand.  Each layer also records
+the names of the layers on which it depends.  New operations share the layers
+of their inputs rather than copy them.
+
+A layer named ``'x'`` holds keys like ``'x'`` or ``('x', 0, 1)``.  We use this
+to find keys quickly.
+
+The scheduler turns a layered dask into a plain dict with ``materialize``, or
+better with ``cull_tasks``, which builds only the tasks needed for some keys,
+so that selecting a few blocks only builds and runs the tasks for those
+blocks.
+"""
+from collections import Mapping, defaultdict
+from itertools import count
+from toolz import merge
+from .core import flatten, istask
+
+
+def key_name(key):
+    """ Name of the layer that probably holds this key
+
+    >>> key_name(('x', 0, 1))
+    'x'
+    >>> key_name('x')
+    'x'
+    """
+    if isinstance(key, tuple) and key:
+        return key[0]
+    return key
+
+
+class LayeredDask(Mapping):
+    """ A dask composed of layers of tasks
+
+    Parameters
+    ----------
+
+    layers: dict
+        Mapping of layer names to mappings of tasks
+    dependencies: dict
+        Mapping of layer names to the set of names of layers on which it
+        depends.  Layers without an entry may depend on anything.
+
+    >>> inc = lambda x: x + 1
+    >>> dsk = LayeredDask({'x': {'x': 1}, 'y': {'y': (inc, 'x')}},
+    ...                   {'x': set(), 'y': set(['x'])})
+    >>> dsk['x']
+    1
+    >>> sorted(dsk)
+    ['x', 'y']
+
+    See Also
+    --------
+
+    add_layer
+    merge_layers
+    """
+    def __init__(self, layers, dependencies):
+        self.layers = layers
+        self.dependencies = dependencies
+
+    def __getitem__(self, key):
+        name = key_name(key)
+        try:
+            if name in self.layers:
+                return self.layers[name][key]
+        except (KeyError, TypeError):
+            pass
+        for layer in self.layers.values():
+            try:
+                return layer[key]
+            except (KeyError, TypeError):
+                pass
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        try:
+            self[key]
+            return True
+        except KeyError:
+            return False
+
+    def __iter__(self):
+        for layer in self.layers.values():
+            for key in layer:
+                yield key
+
+    def __len__(self):
+        return sum(len(layer) for layer in self.layers.values())
+
+
+anonymous = ('dict-%d' % i for i in count(1))
+
+
+def as_layered(dsk):
+    """ Wrap a plain dask as a single layer with unknown dependencies """
+    if isinstance(dsk, LayeredDask):
+        return dsk
+    return LayeredDask({next(anonymous): dsk}, dict())
+
+
+def merge_layers(*dasks):
+    """ Merge several dasks, sharing rather than copying their layers
+
+    >>> a = LayeredDask({'x': {'x': 1}}, {'x': set()})
+    >>> b = LayeredDask({'y': {'y': 2}}, {'y': set()})
+    >>> c = merge_layers(a, b)
+    >>> sorted(c)
+    ['x', 'y']
+    >>> c.layers['x'] is a.layers['x']
+    True
+    """
+    dasks = [as_layered(d) for d in dasks]
+    return LayeredDask(merge([d.layers for d in dasks]),
+                       merge([d.dependencies for d in dasks]))
+
+
+def add_layer(dsk, name, layer, dependencies=()):
+    """ New dask with one more layer on top of ``dsk``
+
+    >>> inc = lambda x: x + 1
+    >>> a = LayeredDask({'x': {'x': 1}}, {'x': set()})
+    >>> b = add_layer(a, 'y', {'y': (inc, 'x')}, ['x'])
+    >>> b.dependencies['y'] == set(['x'])
+    True
+    """
+    dsk = as_layered(dsk)
+    return LayeredDask(merge(dsk.layers, {name: layer}),
+                       merge(dsk.dependencies, {name: set(dependencies)}))
+
+
+def materialize(dsk):
+    """ Plain dict of all tasks in a dask
+
+    Lazy layers with a ``todict`` method build their tasks all at once.
+    """
+    if not isinstance(dsk, LayeredDask):
+        return dsk
+    result = dict()
+    for layer in dsk.layers.values():
+        if hasattr(layer, 'todict'):
+            layer = layer.todict()
+        result.update(layer)
+    return result
+
+
+def task_keys(task):
+    """ Everything in a task that might be a key
+
+    Looks inside nested tasks and lists
+
+    >>> inc = lambda x: x + 1
+    >>> task_keys((inc, 'x', [('y', 0), (inc, 'z')]))
+    ['z', ('y', 0), 'x']
+    """
+    result = []
+    stack = [task]
+    while stack:
+        t = stack.pop()
+        if istask(t):
+            stack.extend(t[1:])
+        elif isinstance(t, list):
+            stack.extend(t)
+        else:
+            result.append(t)
+    return result
+
+
+def layer_order(dsk):
+    """ Names of layers, each before the layers on which it depends
+
+    >>> dsk = LayeredDask({'x': {}, 'y': {}, 'z': {}},
+    ...                   {'x': set(), 'y': set(['x']), 'z': set(['y'])})
+    >>> layer_order(dsk)
+    ['z', 'y', 'x']
+    """
+    order = []
+    seen = set()
+    for name in sorted(dsk.layers, key=str):
+        stack = [(name, False)]
+        while stack:
+            n, done = stack.pop()
+            if done:
+                order.append(n)
+                continue
+            if n in seen or n not in dsk.layers:
+                continue
+            seen.add(n)
+            stack.append((n, True))
+            stack.extend((d, False) for d in dsk.dependencies[n])
+    return order[::-1]
+
+
+def cull_tasks(dsk, keys):
+    """ Plain dict of only the tasks needed to compute ``keys``
+
+    We walk dependencies back from the requested keys, one layer at a time.
+    Lazy layers like ``dask.array.Top`` build only the tasks we need, or all
+    of them at once with ``todict`` if we need them all.
+
+    >>> inc = lambda x: x + 1
+    >>> dsk = LayeredDask({'x': {('x', 0): 1, ('x', 1): 2},
+    ...                    'y': {('y', 0): (inc, ('x', 0)),
+    ...                          ('y', 1): (inc, ('x', 1))}},
+    ...                   {'x': set(), 'y': set(['x'])})
+    >>> sorted(cull_tasks(dsk, [('y', 1)]))
+    [('x', 1), ('y', 1)]
+    """
+    keys = list(flatten(keys)) if isinstance(keys, list) else [keys]
+    if (isinstance(dsk, LayeredDask) and
+            all(n in dsk.dependencies for n in dsk.layers)):
+        layers = dsk.layers
+        order = layer_order(dsk)
+    else:
+        layers = {None: materialize(dsk)}
+        order = [None]
+
+    def find(key):
+        """ Name of the layer holding key, or None """
+        try:
+            name = key_name(key)
+            if name in layers and key in layers[name]:
+                return name
+        except TypeError:  # not hashable
+            return None
+        for name, layer in layers.items():
+            try:
+                if key in layer:
+                    return name
+            except TypeError:
+                pass
+        return None
+
+    needed = defaultdict(set)
+    for key in keys:
+        name = find(key)
+        if name is not None or None in layers:
+            needed[name].add(key)
+
+    result = dict()
+    while needed:
+        for name in order:
+            ks = needed.pop(name, None)
+            if not ks:
+                continue
+            layer = layers[name]
+            if hasattr(layer, 'todict') and len(ks) == len(layer):
+                layer = layer.todict()
+            stack = list(ks)
+            while stack:
+                key = stack.pop()
+                if key in result:
+                    continue
+                task = layer[key]
+                result[key] = task
+                if not istask(task):
+                    continue
+                for dep in task_keys(task):
+                    try:
+                        if dep in result:
+                            continue
+                        if dep in layer:
+                            stack.append(dep)
+                            continue
+                    except TypeError:  # not hashable, not a key
+                        continue
+                    other = find(dep)
+                    if other is not None:
+                        needed[other].add(dep)
+    return result
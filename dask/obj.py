@@ -1,34 +1,58 @@
 
-from into import discover, convert, append
-from toolz import merge, concat, partition
-from datashape import DataShape
+from into import discover, convert, append, resource
+from toolz import merge, concat, partition, curry, compose
+from datashape import DataShape, from_numpy, to_numpy, dshape
 from datashape.dispatch import dispatch
 from operator import add
 import itertools
 from math import ceil
 from collections import Iterable
+from functools import partial
 import operator
+import threading
 import numpy as np
-from . import core, threaded
+import psutil
+from . import core, threaded, disk
 from .threaded import inline
-from .array import (getem, concatenate, concatenate2, top,
-    broadcast_dimensions)
+from .array import (getem, concatenate, concatenate2, Top,
+    broadcast_dimensions, tree_reduce, moment_chunk, moment_combine,
+    moment_agg, moment_dtype, sum_blocks, blockshape_from_chunks, rechunk,
+    blockdims_from_blockshape, slice_array, ghost, trim, cumulative)
+from .layers import LayeredDask, add_layer, merge_layers, cull_tasks
 
 
 class Array(object):
-    """ Array object holding a dask """
-    __slots__ = 'dask', 'name', 'shape', 'blockshape'
+    """ Array object holding a dask
 
-    def __init__(self, dask, name, shape, blockshape):
+    Blocks may vary in size.  ``blockdims`` holds the sizes of the blocks
+    along each axis, e.g. ``((5, 5, 2), (10,))``.  Alternatively give a single
+    ``blockshape`` for blocks of the same size, smaller only at the far edges.
+
+    The ``dtype`` is optional.  We know it for most arrays without computing
+    any blocks.
+    """
+    __slots__ = 'dask', 'name', 'shape', 'blockdims', 'dtype', '_elemwise'
+    __array_priority__ = 11  # Take precedence over NumPy in operators
+
+    def __init__(self, dask, name, shape, blockshape=None, dtype=None,
+                 blockdims=None):
         self.dask = dask
         self.name = name
-        self.shape = shape
-        self.blockshape = blockshape
+        self.shape = tuple(shape)
+        if blockdims is None:
+            blockdims = blockdims_from_blockshape(self.shape, blockshape)
+        self.blockdims = tuple(tuple(bd) for bd in blockdims)
+        self.dtype = np.dtype(dtype) if dtype is not None else None
+        self._elemwise = None
+
+    @property
+    def blockshape(self):
+        """ Shape of the largest block """
+        return tuple(max(bd) if bd else 0 for bd in self.blockdims)
 
     @property
     def numblocks(self):
-        return tuple(int(ceil(a / b))
-                     for a, b in zip(self.shape, self.blockshape))
+        return tuple(len(bd) for bd in self.blockdims)
 
     def _get_block(self, *args):
         return core.get(self.dask, (self.name,) + args)
@@ -48,35 +72,382 @@ class Array(object):
             return [self.keys(*(args + (i,)))
                         for i in range(self.numblocks[ind])]
 
+    def __getitem__(self, index):
+        """ Slice with integers, slices, ``None`` and ``Ellipsis``
+
+        Only blocks that overlap the selection are computed.  See
+        ``dask.array.slice_array``.
+        """
+        name = next(names)
+        dsk, blockdims = slice_array(name, self.name, self.blockdims, index)
+        shape = tuple(sum(bd) for bd in blockdims)
+        return Array(add_layer(self.dask, name, dsk, [self.name]), name,
+                     shape, dtype=self.dtype, blockdims=blockdims)
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        if method != '__call__' or kwargs:
+            return NotImplemented
+        return elemwise(ufunc, *inputs)
+
+    # Elementwise operators, see ``elemwise``
+    def __add__(self, other):
+        return elemwise(operator.add, self, other)
+    def __radd__(self, other):
+        return elemwise(operator.add, other, self)
+    def __sub__(self, other):
+        return elemwise(operator.sub, self, other)
+    def __rsub__(self, other):
+        return elemwise(operator.sub, other, self)
+    def __mul__(self, other):
+        return elemwise(operator.mul, self, other)
+    def __rmul__(self, other):
+        return elemwise(operator.mul, other, self)
+    def __truediv__(self, other):
+        return elemwise(operator.truediv, self, other)
+    def __rtruediv__(self, other):
+        return elemwise(operator.truediv, other, self)
+    def __floordiv__(self, other):
+        return elemwise(operator.floordiv, self, other)
+    def __rfloordiv__(self, other):
+        return elemwise(operator.floordiv, other, self)
+    def __mod__(self, other):
+        return elemwise(operator.mod, self, other)
+    def __rmod__(self, other):
+        return elemwise(operator.mod, other, self)
+    def __pow__(self, other):
+        return elemwise(operator.pow, self, other)
+    def __rpow__(self, other):
+        return elemwise(operator.pow, other, self)
+    def __and__(self, other):
+        return elemwise(operator.and_, self, other)
+    def __rand__(self, other):
+        return elemwise(operator.and_, other, self)
+    def __or__(self, other):
+        return elemwise(operator.or_, self, other)
+    def __ror__(self, other):
+        return elemwise(operator.or_, other, self)
+    def __lt__(self, other):
+        return elemwise(operator.lt, self, other)
+    def __le__(self, other):
+        return elemwise(operator.le, self, other)
+    def __gt__(self, other):
+        return elemwise(operator.gt, self, other)
+    def __ge__(self, other):
+        return elemwise(operator.ge, self, other)
+    def __neg__(self):
+        return elemwise(operator.neg, self)
+    def __abs__(self):
+        return elemwise(operator.abs, self)
+    def __invert__(self):
+        return elemwise(operator.invert, self)
+    __div__ = __truediv__
+    __rdiv__ = __rtruediv__
+
+    def map_blocks(self, func, blockshape=None, blockdims=None, dtype=None):
+        """ Apply a function to every block
+
+        ``func`` takes and returns a NumPy array.  If it changes the shape of
+        blocks then give the new ``blockshape``, or the new ``blockdims`` if
+        blocks differ in size, as at the edges of ragged arrays.  We infer the
+        ``dtype`` if not given.
+
+        >>> x = into(Array, np.arange(6), blockshape=(3,))  # doctest: +SKIP
+        >>> y = x.map_blocks(lambda b: b[::2], blockshape=(2,))  # doctest: +SKIP
+        >>> into(np.ndarray, y)  # doctest: +SKIP
+        array([0, 2, 3, 5])
+        """
+        result = blockwise(func, self, dtype=dtype)
+        if blockdims is None and blockshape is None:
+            return result
+        if blockdims is None:
+            if any(len(set(bd)) > 1 for bd in self.blockdims):
+                raise ValueError("Blocks differ in size, %s, so we can not "
+                                 "tell the size of the output blocks from a "
+                                 "blockshape.  Give blockdims instead"
+                                 % (self.blockdims,))
+            blockdims = tuple((d,) * n
+                              for d, n in zip(blockshape, self.numblocks))
+        if tuple(map(len, blockdims)) != self.numblocks:
+            raise ValueError("Expected blockdims with %s blocks, got %s"
+                             % (self.numblocks, blockdims))
+        shape = tuple(sum(bd) for bd in blockdims)
+        return Array(result.dask, result.name, shape, dtype=result.dtype,
+                     blockdims=blockdims)
+
+    def map_overlap(self, func, depth, boundary='reflect', dtype=None):
+        """ Apply a function to blocks extended by their neighbors' edges
+
+        For stencils and filters that need data near block edges.  We extend
+        each block by ``depth`` elements from its neighbors, apply ``func``,
+        which must keep the shape of blocks, and trim off the extra elements
+        again.  See ``dask.array.ghost`` for ``depth`` and ``boundary``.
+
+        >>> smooth = lambda b: (np.roll(b, 1) + b + np.roll(b, -1)) / 3.0
+        >>> y = x.map_overlap(smooth, depth=1, boundary='periodic')  # doctest: +SKIP
+        """
+        name = next(names)
+        dsk, blockdims = ghost(self.name, name, self.blockdims, depth,
+                               boundary)
+        g = Array(add_layer(self.dask, name, dsk, [self.name]), name,
+                  tuple(sum(bd) for bd in blockdims), dtype=self.dtype,
+                  blockdims=blockdims)
+        h = g.map_blocks(func, dtype=dtype)
+        name = next(names)
+        dsk = trim(h.name, name, self.blockdims, depth, boundary)
+        return Array(add_layer(h.dask, name, dsk, [h.name]), name,
+                     self.shape, dtype=h.dtype, blockdims=self.blockdims)
+
+    def moment(self, order, axis=None):
+        """ Central moment of some order, see ``moment_reduction``
+
+        >>> x.moment(3, axis=0)  # doctest: +SKIP
+        """
+        if axis is None:
+            axis = tuple(range(self.ndim))
+        if isinstance(axis, int):
+            axis = (axis,)
+        axis = tuple(a + self.ndim if a < 0 else a for a in axis)
+        return moment_reduction(self, axis, 'moment', order=order)
+
+    def cumsum(self, axis):
+        """ Cumulative sum along an axis, see ``dask.array.cumulative`` """
+        return cumreduction(np.cumsum, operator.add, self, axis)
+
+    def cumprod(self, axis):
+        """ Cumulative product along an axis """
+        return cumreduction(np.cumprod, operator.mul, self, axis)
+
+    def rechunk(self, blockshape=None, blockdims=None):
+        """ Same array with new blocks
+
+        See ``dask.array.rechunk``
+        """
+        if blockdims is None:
+            blockdims = blockdims_from_blockshape(self.shape, blockshape)
+        blockdims = tuple(tuple(bd) for bd in blockdims)
+        if blockdims == self.blockdims:
+            return self
+        name = next(names)
+        dsk = rechunk(self.name, name, self.blockdims, blockdims)
+        return Array(add_layer(self.dask, name, dsk, [self.name]), name,
+                     self.shape, dtype=self.dtype, blockdims=blockdims)
+
+
+def infer_dtype(func, out_ind, arginds):
+    """ Find the dtype of a tensor operation by running it on tiny arrays
+
+    We call ``func`` on arrays of ones with one element, wrapped in singleton
+    lists along contracted indices.  Returns None if we can't tell.
+
+    >>> x = Array({}, 'x', (10,), (5,), dtype='i4')
+    >>> infer_dtype(np.sqrt, 'i', [(x, 'i')])
+    dtype('float64')
+    """
+    if any(a.dtype is None for a, _ in arginds):
+        return None
+    args = []
+    for a, ind in arginds:
+        x = np.ones((1,) * a.ndim, dtype=a.dtype)
+        for i in ind:
+            if i not in out_ind:  # Contracted index, nest in a list
+                x = [x]
+        args.append(x)
+    try:
+        with np.errstate(all='ignore'):
+            return np.asarray(func(*args)).dtype
+    except Exception:
+        return None
+
 
-def atop(func, out, out_ind, *args):
-    """ Array object version of dask.array.top """
+def atop(func, out, out_ind, *args, **kwargs):
+    """ Array object version of dask.array.top
+
+    Pass the output ``dtype`` if known, otherwise we try to infer it.
+    """
     arginds = list(partition(2, args)) # [x, ij, y, jk] -> [(x, ij), (y, jk)]
     numblocks = dict([(a.name, a.numblocks) for a, ind in arginds])
     argindsstr = list(concat([(a.name, ind) for a, ind in arginds]))
 
-    dsk = top(func, out, out_ind, *argindsstr, numblocks=numblocks)
+    dsk = Top(func, out, out_ind, *argindsstr, numblocks=numblocks)
 
     # Dictionary mapping {i: 3, j: 4, ...} for i, j, ... the dimensions
     shapes = dict((a, a.shape) for a, _ in arginds)
     dims = broadcast_dimensions(arginds, shapes)
-    blockshapes = dict((a, a.blockshape) for a, _ in arginds)
-    blockdims = broadcast_dimensions(arginds, blockshapes)
+    blockdimss = dict((a, a.blockdims) for a, _ in arginds)
+    blockdims = broadcast_dimensions(arginds, blockdimss)
 
     shape = tuple(dims[i] for i in out_ind)
-    blockshape = tuple(blockdims[i] for i in out_ind)
+    blockdims = tuple(blockdims[i] for i in out_ind)
+
+    dtype = kwargs.get('dtype')
+    if dtype is None:
+        dtype = infer_dtype(func, out_ind, arginds)
 
     dsks = [a.dask for a, _ in arginds]
-    return Array(merge(dsk, *dsks), out, shape, blockshape)
+    deps = [a.name for a, _ in arginds]
+    return Array(add_layer(merge_layers(*dsks), out, dsk, deps),
+                 out, shape, dtype=dtype, blockdims=blockdims)
+
+
+def fused(task, leaves, *blocks):
+    """ Evaluate a task against blocks named by ``leaves``
+
+    >>> fused((add, 'x', (operator.mul, 'y', 10)), ['x', 'y'], 1, 2)
+    21
+    """
+    return core.get(dict(zip(leaves, blocks)), task)
+
+
+def broadcast_blockdims(shape, arrays):
+    """ Blockdims for an array of ``shape`` to broadcast against ``arrays``
+
+    Axes align from the end, as in NumPy broadcasting.  We take the blocks of
+    an Array of the same length along each axis, or one block otherwise.
+
+    >>> x = Array({}, 'x', (20, 30), blockshape=(4, 5))
+    >>> broadcast_blockdims((30,), [x])
+    ((5, 5, 5, 5, 5, 5),)
+    >>> broadcast_blockdims((1, 30), [x])
+    ((1,), (5, 5, 5, 5, 5, 5))
+    >>> broadcast_blockdims((20,), [x])
+    Traceback (most recent call last):
+        ...
+    ValueError: Shape (20,) does not broadcast against shapes [(20, 30)]
+    """
+    blockdims = []
+    for i, n in enumerate(shape):
+        axis = i - len(shape)
+        dims = [(a.shape[axis], a.blockdims[axis]) for a in arrays
+                if a.ndim >= -axis]
+        if n != 1 and any(m not in (1, n) for m, _ in dims):
+            raise ValueError("Shape %s does not broadcast against shapes %s"
+                             % (tuple(shape), [a.shape for a in arrays]))
+        bds = [bd for m, bd in dims if m == n]
+        blockdims.append(bds[0] if n != 1 and bds else (n,))
+    return tuple(blockdims)
+
+
+def elemwise(op, *args, **kwargs):
+    """ Apply an elementwise function across Arrays and scalars
+
+    Arrays broadcast against each other as in NumPy.  Inputs that came from
+    ``elemwise`` themselves fuse into a single task per block, so a chain
+    like ``(x + 1) * y - z`` makes no intermediate blocks.
+
+    We keep the unevaluated expression on ``_elemwise`` as a task over the
+    names of the leaf Arrays, e.g. ``(sub, (mul, (add, 'x', 1), 'y'), 'z')``.
+
+    NumPy arrays become Arrays with blocks that line up with the others, see
+    ``broadcast_blockdims``.
+
+    Pass the output ``dtype`` if known, otherwise we infer it.
+
+    See Also:
+        blockwise
+    """
+    arrays = [arg for arg in args if isinstance(arg, Array)]
+    args = [array_to_dask(arg, blockdims=broadcast_blockdims(arg.shape, arrays))
+            if isinstance(arg, np.ndarray) and arg.ndim else arg
+            for arg in args]
+    leaves = dict()
+    task = [op]
+    for arg in args:
+        if isinstance(arg, Array):
+            if arg._elemwise is not None:
+                subtask, subleaves = arg._elemwise
+                leaves.update(subleaves)
+                task.append(subtask)
+            else:
+                leaves[arg.name] = arg
+                task.append(arg.name)
+        else:
+            task.append(arg)
+    task = tuple(task)
+
+    names_ = sorted(leaves)
+    arrays = [leaves[n] for n in names_]
+    ndim = max(a.ndim for a in arrays)
+    out_ind = tuple(range(ndim))[::-1]
+    result = atop(partial(fused, task, names_), next(names), out_ind,
+                  *concat((a, tuple(range(a.ndim))[::-1]) for a in arrays),
+                  dtype=kwargs.get('dtype'))
+    result._elemwise = (task, leaves)
+    return result
+
+
+def blockwise(func, x, dtype=None):
+    """ Apply ``func`` to each block of ``x``
+
+    If ``x`` came from ``elemwise`` then we fuse ``func`` into the same task
+    as the elementwise expression, as for the first step of a reduction like
+    ``(x ** 2).sum()``.  The elementwise blocks are then never held in memory.
+
+    Returns an Array with the blocks of ``x``, whatever ``func`` returns.
+    """
+    if x._elemwise is None:
+        inds = tuple(range(x.ndim))
+        return atop(func, next(names), inds, x, inds, dtype=dtype)
+    task, leaves = x._elemwise
+    names_ = sorted(leaves)
+    arrays = [leaves[n] for n in names_]
+    out_ind = tuple(range(x.ndim))[::-1]
+    return atop(partial(fused, (func, task), names_), next(names), out_ind,
+                *concat((a, tuple(range(a.ndim))[::-1]) for a in arrays),
+                dtype=dtype)
+
+
+def moment_reduction(x, axes, stat, ddof=0, order=2, split_every=4):
+    """ Mean, var, std or central moment of an Array along axes
+
+    Each block emits its count, mean and sums of powers of deviations.  We
+    merge these in a tree with the parallel Welford update, reading the data
+    once.  See ``dask.array.moment_agg`` for ``stat``.
+    """
+    tmp = blockwise(curry(moment_chunk, axis=axes, order=order), x,
+                    dtype=moment_dtype(order))
+
+    combine = compose(curry(moment_combine, axis=axes),
+                      curry(concatenate2, axes=axes))
+    aggregate = compose(curry(moment_agg, axis=axes, stat=stat, ddof=ddof,
+                              order=order),
+                        curry(concatenate2, axes=axes))
+
+    name = next(names)
+    dsk = tree_reduce(combine, aggregate, tmp.name, tmp.numblocks, axes,
+                      name, split_every=split_every)
+
+    shape = tuple(d for i, d in enumerate(x.shape) if i not in axes)
+    blockdims = tuple(bd for i, bd in enumerate(x.blockdims)
+                         if i not in axes)
+    return Array(add_layer(tmp.dask, name, dsk, [tmp.name]), name, shape,
+                 dtype='f8', blockdims=blockdims)
+
+
+def cumreduction(func, binop, x, axis):
+    """ Cumulative reduction of an Array along an axis """
+    if axis < 0:
+        axis += x.ndim
+    if not 0 <= axis < x.ndim:
+        raise ValueError("Axis %d out of bounds for %d dimensions"
+                         % (axis, x.ndim))
+    name = next(names)
+    dsk = cumulative(func, binop, x.name, name, x.numblocks, axis)
+    dtype = None
+    if x.dtype is not None:
+        dtype = func(np.ones((1,), dtype=x.dtype)).dtype
+    return Array(add_layer(x.dask, name, dsk, [x.name]), name, x.shape,
+                 dtype=dtype, blockdims=x.blockdims)
 
 
 @discover.register(Array)
 def discover_dask_array(a, **kwargs):
+    if a.dtype is not None:
+        return from_numpy(a.shape, a.dtype)
     block = a._get_block(*([0] * a.ndim))
     return DataShape(*(a.shape + (discover(block).measure,)))
 
 
-arrays = [np.ndarray]
+arrays = [np.ndarray, np.memmap]
 try:
     import h5py
     arrays.append(h5py.Dataset)
@@ -91,29 +462,78 @@ except ImportError:
 
 names = ('x_%d' % i for i in itertools.count(1))
 
+
+@dispatch(h5py.Dataset)
+def storage_chunks(x):
+    """ Shape of the chunks in which ``x`` is stored """
+    return x.chunks or (1,) * x.ndim
+
+
+@dispatch(bcolz.carray)
+def storage_chunks(x):
+    return (x.chunklen,) + x.shape[1:]
+
+
+@dispatch(object)
+def storage_chunks(x):
+    return (1,) * len(x.shape)
+
+
 @convert.register(Array, tuple(arrays), cost=0.01)
-def array_to_dask(x, name=None, blockshape=None, **kwargs):
+def array_to_dask(x, name=None, blockshape=None, blockdims=None, **kwargs):
+    """ Dask Array of blocks of an array-like
+
+    Give either a ``blockshape`` or the sizes of the blocks along each axis,
+    ``blockdims``.  With neither, or with ``blockshape='auto'``, we choose
+    blocks made of whole storage chunks, see
+    ``dask.array.blockshape_from_chunks``.
+    """
     name = name or next(names)
-    dask = merge({name: x}, getem(name, blockshape, x.shape))
+    if blockdims is None:
+        if blockshape is None or blockshape == 'auto':
+            blockshape = blockshape_from_chunks(x.shape, storage_chunks(x),
+                    x.dtype.itemsize,
+                    nblocks=kwargs.get('nthreads', psutil.NUM_CPUS))
+        blockdims = blockdims_from_blockshape(x.shape, blockshape)
+    dask = LayeredDask({name: merge({name: x},
+                                    getem(name, blockdims=blockdims))},
+                       {name: set()})
 
-    return Array(dask, name, x.shape, blockshape)
+    return Array(dask, name, x.shape, dtype=x.dtype, blockdims=blockdims)
 
 
 def get(dsk, keys, get=threaded.get, **kwargs):
     """ Specialized get function
 
-    1. Handle inlining
-    2. Use custom score function
+    1. Cull unnecessary tasks and build only those that remain
+    2. Handle inlining
+    3. Use custom score function
+    4. Optionally prefetch source blocks, see ``threaded.get``
     """
+    dsk = cull_tasks(dsk, keys)
     fast_functions=kwargs.get('fast_functions',
                              set([operator.getitem, np.transpose]))
+    if kwargs.get('prefetch'):
+        # Keep reads as separate tasks so that they may run ahead
+        io_functions = kwargs.setdefault('io_functions',
+                                         set([operator.getitem]))
+        fast_functions = set(fast_functions) - set(io_functions)
     dsk2 = inline(dsk, fast_functions=fast_functions)
     return get(dsk2, keys, **kwargs)
 
 
 @convert.register(np.ndarray, Array, cost=0.5)
 def dask_to_numpy(x, **kwargs):
-    return concatenate(get(x.dask, x.keys(), **kwargs))
+    """ Compute a dask Array into a NumPy array
+
+    If we know the dtype then we allocate the result once and write each block
+    into place as soon as it finishes.  The scheduler then releases that block
+    so we need little more memory than the result itself.
+    """
+    if x.dtype is None:
+        return concatenate(get(x.dask, x.keys(), **kwargs))
+    out = np.empty(x.shape, dtype=x.dtype)
+    return store(out, x, **kwargs)
 
 
 @convert.register(float, Array, cost=0.5)
@@ -125,30 +545,194 @@ def dask_to_float(x, **kwargs):
     return result
 
 
-def insert_to_ooc(out, arr):
-    from threading import Lock
-    lock = Lock()
-    def store(x, *args):
-        with lock:
-            ind = tuple([slice(i*d, (i+1)*d) for i, d in zip(args, arr.blockshape)])
+def insert_to_ooc(out, arr, lock=True, offset=0, batch=1):
+    """ Dask to store the blocks of ``arr`` into the array-like ``out``
+
+    Parameters
+    ----------
+
+    lock: Lock, bool
+        Writes hold this lock.  ``True`` makes a new lock, ``False`` writes
+        concurrently, as NumPy arrays allow for disjoint regions.
+    offset: int
+        Write to ``out`` starting at this row
+    batch: int
+        Concatenate this many neighboring blocks along the first axis and
+        store them in one write
+
+    Raises ValueError on writing a block whose shape does not match
+    ``arr.blockdims``, rather than leave part of ``out`` unwritten.
+    """
+    if lock is True:
+        lock = threading.Lock()
+
+    starts = [np.cumsum((0,) + bd).tolist() for bd in arr.blockdims]
+    step = 1 if batch <= 1 or arr.ndim == 0 else batch
+
+    def write(x, *args):
+        stops = [i + 1 for i in args]
+        if stops:
+            stops[0] = min(args[0] + step, arr.numblocks[0])
+        ind = tuple([slice(s[i], s[j]) for i, j, s in zip(args, stops, starts)])
+        expected = tuple(i.stop - i.start for i in ind)
+        if np.shape(x) != expected:
+            raise ValueError("Block %s has shape %s, expected %s"
+                             % (args, np.shape(x), expected))
+        if ind:
+            ind = (slice(ind[0].start + offset, ind[0].stop + offset),) + ind[1:]
+        if lock:
+            with lock:
+                out[ind] = x
+        else:
             out[ind] = x
         return None
 
     name = 'store-%s' % arr.name
-    return dict(((name,) + t[1:], (store, t) + t[1:]) for t in core.flatten(arr.keys()))
+    keys = list(core.flatten(arr.keys())) if all(arr.numblocks) else []
+    if batch <= 1 or arr.ndim == 0:
+        return dict(((name,) + t[1:], (write, t) + t[1:]) for t in keys)
+
+    def write_batch(index, blocks):
+        return write(np.concatenate(list(blocks)), *index)
+
+    # Block keys go in a top-level list, where the scheduler finds them
+    groups = dict()
+    for t in keys:
+        k = (name, t[1] // batch) + t[2:]
+        groups.setdefault(k, []).append(t)
+    return dict((k, (partial(write_batch, (k[1] * batch,) + k[2:]), sorted(ts)))
+                for k, ts in groups.items())
+
+
+@dispatch(np.ndarray)
+def store_lock(x):
+    """ Lock to hold while writing to ``x``, or False if we need none """
+    return False
+
+
+file_locks = dict()
+_file_locks_lock = threading.Lock()
+
+@dispatch(h5py.Dataset)
+def store_lock(x):
+    """ HDF5 isn't threadsafe, share one lock among datasets of a file """
+    with _file_locks_lock:
+        return file_locks.setdefault(x.file.filename, threading.Lock())
+
+
+@dispatch(object)
+def store_lock(x):
+    return threading.Lock()
+
+
+@dispatch(h5py.Dataset)
+def store_chunklen(x):
+    """ Number of rows in one chunk of the storage of ``x`` """
+    return x.chunks[0] if x.chunks else 1
+
+
+@dispatch(bcolz.carray)
+def store_chunklen(x):
+    return x.chunklen
+
+
+@dispatch(object)
+def store_chunklen(x):
+    return 1
+
+
+def store(out, arr, offset=0, **kwargs):
+    """ Store dask Array ``arr`` into the array-like ``out``
+
+    Blocks compute and write in parallel.  We lock only around writes to
+    targets that need it, e.g. one lock per HDF5 file, and none for NumPy
+    arrays and memmaps.  We batch small blocks along the first axis so that
+    each write fills whole chunks of the target's storage.
+
+    >>> x = np.arange(12).reshape((4, 3))
+    >>> a = into(Array, x, blockshape=(2, 2))  # doctest: +SKIP
+    >>> store(np.empty((4, 3), dtype=x.dtype), a)  # doctest: +SKIP
+    array([[ 0,  1,  2],
+           [ 3,  4,  5],
+           [ 6,  7,  8],
+           [ 9, 10, 11]])
+    """
+    if arr.ndim:
+        batch = store_chunklen(out) // max(arr.blockshape[0], 1)
+    else:
+        batch = 1
+    update = insert_to_ooc(out, arr, lock=store_lock(out), offset=offset,
+                           batch=batch)
+    if update:  # Empty arrays have no blocks to write
+        dsk = add_layer(arr.dask, 'store-%s' % arr.name, update, [arr.name])
+        get(dsk, list(update.keys()), **kwargs)
+    if hasattr(out, 'flush'):
+        out.flush()
+    return out
 
 
 @append.register(tuple(arrays), Array)
 def store_Array_in_ooc_data(out, arr, **kwargs):
-    update = insert_to_ooc(out, arr)
-    dsk = merge(arr.dask, update)
-
     # Resize output dataset to accept new data
     assert out.shape[1:] == arr.shape[1:]
-    resize(out, out.shape[0] + arr.shape[0])  # elongate
+    n = out.shape[0]
+    resize(out, n + arr.shape[0])  # elongate
+
+    return store(out, arr, offset=n, **kwargs)
 
+
+def to_disk(arr, path, compression=disk.default_compression, **kwargs):
+    """ Write an Array to a directory of compressed blocks
+
+    Each block compresses and writes to its own file in its own task, so
+    writes run in parallel without locks.  See ``dask.disk``.
+    """
+    dtype = arr.dtype
+    if dtype is None:
+        dtype = discover(arr).measure.to_numpy_dtype()
+    disk.write_metadata(path, arr.shape, arr.blockdims, dtype,
+                        compression=compression)
+    name = 'store-%s' % arr.name
+    update = disk.store_dask(path, arr.name, name, arr.numblocks,
+                             compression=compression)
+    dsk = add_layer(arr.dask, name, update, [arr.name])
     get(dsk, list(update.keys()), **kwargs)
-    return out
+
+
+def from_disk(path, name=None):
+    """ Array of the blocks stored at ``path`` by ``to_disk`` """
+    name = name or next(names)
+    dsk, meta = disk.load_dask(path, name)
+    return Array(LayeredDask({name: dsk}, {name: set()}), name,
+                 meta['shape'], dtype=meta['dtype'],
+                 blockdims=meta['blockdims'])
+
+
+@append.register(np.memmap, Array)
+def store_Array_in_memmap(out, arr, **kwargs):
+    """ Fill a memmap with an Array
+
+    A memmap can't grow so we write into it whole, see ``resource_npy``.
+    """
+    assert out.shape == arr.shape
+    return store(out, arr, **kwargs)
+
+
+@resource.register(r'.+\.npy')
+def resource_npy(uri, expected_dshape=None, mode='r', **kwargs):
+    """ Memory map a ``.npy`` file
+
+    Blocks of an Array over this memmap are views into the mapped file.  The
+    operating system pages data in and out as we touch it.
+
+    When given the ``expected_dshape`` of incoming data, as by ``into``, we
+    create a new file of that shape.
+    """
+    if expected_dshape is not None:
+        shape, dtype = to_numpy(dshape(expected_dshape))
+        return np.lib.format.open_memmap(uri, mode='w+', dtype=dtype,
+                                         shape=shape)
+    return np.load(uri, mmap_mode=mode)
 
 
 @dispatch(bcolz.carray, int)
@@ -169,8 +753,16 @@ def resize(x, shape):
 from blaze.dispatch import dispatch
 from blaze.compute.core import compute_up
 from blaze import compute, ndim
-from blaze.expr import ElemWise, symbol, Reduction, Transpose, TensorDot, Expr
-from toolz import curry, compose
+from blaze.expr import (ElemWise, symbol, Reduction, Transpose, TensorDot,
+        Expr, Slice)
+
+def dshape_dtype(expr):
+    """ NumPy dtype of the measure of a blaze expression, or None """
+    try:
+        return expr.dshape.measure.to_numpy_dtype()
+    except Exception:
+        return None
+
 
 def compute_it(expr, leaves, *data, **kwargs):
     kwargs.pop('scope')
@@ -178,73 +770,121 @@ def compute_it(expr, leaves, *data, **kwargs):
 
 
 def elemwise_array(expr, *data, **kwargs):
+    """ Elementwise expressions fuse with their inputs, see ``elemwise`` """
     leaves = expr._inputs
-    expr_inds = tuple(range(ndim(expr)))[::-1]
-    return atop(curry(compute_it, expr, leaves, **kwargs),
-                next(names), expr_inds,
-                *concat((dat, tuple(range(ndim(dat))[::-1])) for dat in data))
+    return elemwise(curry(compute_it, expr, leaves, **kwargs), *data,
+                    dtype=dshape_dtype(expr))
 
 for i in range(10):
     compute_up.register(ElemWise, *([Array] * i))(elemwise_array)
 
 
 from blaze.expr.split import split
+from blaze.expr import reductions
+
+# Reductions whose aggregated partial results we may combine again
+tree_combines = {reductions.sum: np.sum,
+                 reductions.count: np.sum,
+                 reductions.nelements: np.sum,
+                 reductions.min: np.min,
+                 reductions.max: np.max,
+                 reductions.any: np.any,
+                 reductions.all: np.all}
+
 
 @dispatch(Reduction, Array)
-def compute_up(expr, data, **kwargs):
+def compute_up(expr, data, split_every=4, **kwargs):
+    """ Reduce each block, then combine partial results in a tree
+
+    We combine groups of ``split_every`` neighboring partial results along
+    each reduced axis, level by level, until one group remains to aggregate.
+    """
     leaf = expr._leaves()[0]
     chunk = symbol('chunk', DataShape(*(data.blockshape +
         (leaf.dshape.measure,))))
     (chunk, chunk_expr), (agg, agg_expr) = split(expr._child, expr, chunk=chunk)
 
-    inds = tuple(range(ndim(leaf)))
-    tmp = atop(curry(compute_it, chunk_expr, [chunk], **kwargs),
-               next(names), inds,
-               data, inds)
-
-    return atop(compose(curry(compute_it, agg_expr, [agg], **kwargs),
-                        curry(concatenate2, axes=expr.axis)),
-                next(names), tuple(i for i in inds if i not in expr.axis),
-                tmp, inds)
+    axes = tuple(expr.axis)
+    # Fuse with an elementwise child, computing both in one task per block
+    tmp = blockwise(curry(compute_it, chunk_expr, [chunk], **kwargs), data,
+                    dtype=dshape_dtype(chunk_expr))
+
+    if type(expr) in tree_combines:
+        combine = compose(curry(tree_combines[type(expr)], axis=axes,
+                                keepdims=True),
+                          curry(concatenate2, axes=axes))
+    else:  # Partial results don't combine, aggregate all at once
+        combine = None
+        split_every = max(data.numblocks + (1,))
+    aggregate = compose(curry(compute_it, agg_expr, [agg], **kwargs),
+                        curry(concatenate2, axes=axes))
+
+    name = next(names)
+    dsk = tree_reduce(combine, aggregate, tmp.name, tmp.numblocks, axes,
+                      name, split_every=split_every)
+
+    shape = tuple(d for i, d in enumerate(data.shape) if i not in axes)
+    blockdims = tuple(bd for i, bd in enumerate(data.blockdims)
+                         if i not in axes)
+    return Array(add_layer(tmp.dask, name, dsk, [tmp.name]), name, shape,
+                 dtype=dshape_dtype(expr), blockdims=blockdims)
+
+
+@dispatch((reductions.mean, reductions.var, reductions.std), Array)
+def compute_up(expr, data, split_every=4, **kwargs):
+    """ Mean, variance and standard deviation from partial moments """
+    ddof = 1 if getattr(expr, 'unbiased', False) else 0
+    return moment_reduction(data, tuple(expr.axis), type(expr).__name__,
+                            ddof=ddof, split_every=split_every)
+
+
+@dispatch(Slice, Array)
+def compute_up(expr, data, **kwargs):
+    """ Slice only the blocks that overlap the selection """
+    return data[expr.index]
 
 
 @dispatch(Transpose, Array)
 def compute_up(expr, data, **kwargs):
     return atop(curry(np.transpose, axes=expr.axes),
                 next(names), expr.axes,
-                data, tuple(range(ndim(expr))))
+                data, tuple(range(ndim(expr))), dtype=data.dtype)
 
 
 alphabet = 'abcdefghijklmnopqrstuvwxyz'
 ALPHABET = alphabet.upper()
 
 
-@curry
-def many(a, b, binop=None, reduction=None, **kwargs):
-    """
-    Apply binary operator to pairwise to sequences, then reduce.
+@dispatch(TensorDot, Array, Array)
+def compute_up(expr, lhs, rhs, split_every=4, **kwargs):
+    """ Blocked tensordot, with separate tasks along the contraction
 
-    >>> many([1, 2, 3], [10, 20, 30], mul, sum)  # dot product
-    140
+    Each product of a pair of blocks is its own task, indexed by both output
+    and contracted blocks.  We sum these partial products in a tree along the
+    contracted blocks so that long contractions use many threads.
     """
-    return reduction(map(curry(binop, **kwargs), a, b))
-
-
-
-@dispatch(TensorDot, Array, Array)
-def compute_up(expr, lhs, rhs, **kwargs):
     left_index = list(alphabet[:ndim(lhs)])
     right_index = list(ALPHABET[:ndim(rhs)])
     out_index = left_index + right_index
+    contracted = []
     for l, r in zip(expr._left_axes, expr._right_axes):
         out_index.remove(right_index[r])
         out_index.remove(left_index[l])
         right_index[r] = left_index[l]
-
-    func = many(binop=np.tensordot, reduction=sum,
-                axes=(expr._left_axes, expr._right_axes))
-    return atop(func,
-                next(names), out_index,
-                lhs, tuple(left_index),
-                rhs, tuple(right_index))
-
+        contracted.append(left_index[l])
+
+    func = curry(np.tensordot, axes=(expr._left_axes, expr._right_axes))
+    partials = atop(func,
+                    next(names), out_index + contracted,
+                    lhs, tuple(left_index),
+                    rhs, tuple(right_index), dtype=dshape_dtype(expr))
+
+    n = len(out_index)
+    axes = tuple(range(n, n + len(contracted)))
+    name = next(names)
+    dsk = tree_reduce(sum_blocks, sum_blocks, partials.name,
+                      partials.numblocks, axes, name, split_every=split_every)
+
+    return Array(add_layer(partials.dask, name, dsk, [partials.name]), name,
+                 partials.shape[:n], dtype=partials.dtype,
+                 blockdims=partials.blockdims[:n])
@@ -0,0 +1,76 @@
+"""
+Move NumPy arrays between processes through shared memory
+
+Pickling large NumPy arrays to and from worker processes is expensive.
+Instead we write results into files in a shared memory filesystem (``/dev/shm``
+where available) and map them back in with ``np.memmap``.  Only a small
+descriptor, a ``SharedArray``, crosses the process boundary.
+"""
+import os
+import tempfile
+import numpy as np
+
+
+if os.path.isdir('/dev/shm'):
+    default_dir = '/dev/shm'
+else:
+    default_dir = tempfile.gettempdir()
+
+
+class SharedArray(object):
+    """ Descriptor of a NumPy array held in shared memory """
+    __slots__ = 'filename', 'dtype', 'shape'
+
+    def __init__(self, filename, dtype, shape):
+        self.filename = filename
+        self.dtype = dtype
+        self.shape = shape
+
+    def __getstate__(self):
+        return (self.filename, self.dtype, self.shape)
+
+    def __setstate__(self, state):
+        self.filename, self.dtype, self.shape = state
+
+
+def to_shared(x, dir=None):
+    """ Copy a NumPy array into shared memory, return a descriptor
+
+    >>> x = np.arange(5)
+    >>> s = to_shared(x)
+    >>> from_shared(s)
+    memmap([0, 1, 2, 3, 4])
+    >>> release(s)
+
+    Arrays that hold no data aren't worth sharing and pass through
+
+    >>> to_shared(np.ones(0))
+    array([], dtype=float64)
+    """
+    if not isinstance(x, np.ndarray) or not x.nbytes or x.dtype.hasobject:
+        return x
+    fd, filename = tempfile.mkstemp(prefix='dask-', suffix='.dat',
+                                    dir=dir or default_dir)
+    os.close(fd)
+    m = np.memmap(filename, dtype=x.dtype, mode='w+', shape=x.shape)
+    m[...] = x
+    del m
+    return SharedArray(filename, x.dtype, x.shape)
+
+
+def from_shared(s):
+    """ Map an array in shared memory into this process without copying """
+    if not isinstance(s, SharedArray):
+        return s
+    return np.memmap(s.filename, dtype=s.dtype, mode='r+', shape=s.shape)
+
+
+def release(s):
+    """ Free the shared memory behind a descriptor
+
+    Arrays already mapped into a process remain valid.
+    """
+    try:
+        os.remove(s.filename)
+    except OSError:
+        pass
@@ -1,6 +1,10 @@
 import dask
+from dask import core
+import itertools
+import operator
 from dask.array import *
 from toolz import merge
+from dask.utils import raises
 
 def contains(a, b):
     """
@@ -110,3 +114,254 @@ def test_chunked_transpose_plus_one():
     out = dask.get(dsk, [[('out', i, j) for j in range(4)] for i in range(4)])
 
     assert eq(concatenate(out), x.T + 1)
+
+
+def test_partial_reduce():
+    assert partial_reduce(sum, 'x', (5,), (0,), 'y', split_every=2) == \
+        {('y', 0): (sum, [('x', 0), ('x', 1)]),
+         ('y', 1): (sum, [('x', 2), ('x', 3)]),
+         ('y', 2): (sum, [('x', 4)])}
+
+    assert partial_reduce(sum, 'x', (2, 3), (1,), 'y', split_every=3,
+                          keepdims=False) == \
+        {('y', 0): (sum, [('x', 0, 0), ('x', 0, 1), ('x', 0, 2)]),
+         ('y', 1): (sum, [('x', 1, 0), ('x', 1, 1), ('x', 1, 2)])}
+
+    assert partial_reduce(sum, 'x', (3, 3), (0, 1), 'y', split_every=2) == \
+        {('y', 0, 0): (sum, [[('x', 0, 0), ('x', 0, 1)],
+                             [('x', 1, 0), ('x', 1, 1)]]),
+         ('y', 0, 1): (sum, [[('x', 0, 2)], [('x', 1, 2)]]),
+         ('y', 1, 0): (sum, [[('x', 2, 0), ('x', 2, 1)]]),
+         ('y', 1, 1): (sum, [[('x', 2, 2)]])}
+
+    assert raises(ValueError, lambda: partial_reduce(sum, 'x', (3,), (0,),
+                                                     'y', split_every=2,
+                                                     keepdims=False))
+
+
+def test_tree_reduce():
+    x = np.arange(600).reshape((20, 30))
+    d = merge({'x': x}, getem('x', (2, 3), (20, 30)))
+
+    chunk = top(partial(np.sum, axis=(0, 1), keepdims=True),
+                'chunk', 'ij', 'x', 'ij', numblocks={'x': (10, 10)})
+    combine = lambda L: np.sum(concatenate2(L, axes=[0, 1]), axis=(0, 1),
+                               keepdims=True)
+    aggregate = lambda L: np.sum(concatenate2(L, axes=[0, 1]))
+
+    dsk = tree_reduce(combine, aggregate, 'chunk', (10, 10), (0, 1), 'total',
+                      split_every=3)
+    assert max(len(v[1]) for v in dsk.values()) <= 3
+    assert dask.get(merge(d, chunk, dsk), ('total',)) == x.sum()
+
+    combine0 = lambda L: np.sum(concatenate2(L, axes=[0]), axis=0,
+                                keepdims=True)
+    dsk = tree_reduce(combine0, combine0, 'chunk', (10, 10), (0,), 'out',
+                      split_every=3)
+    out = dask.get(merge(d, chunk, dsk), [('out', j) for j in range(10)])
+    assert eq(concatenate(out).squeeze(), x.reshape((20, 10, 3)).sum(axis=(0, 2)))
+
+
+def test_moments():
+    np.random.seed(0)
+    x = (1e4 + np.random.random((20, 30))).astype('f4')
+    d = merge({'x': x}, getem('x', (3, 7), (20, 30)))
+    numblocks = (7, 5)
+
+    def compute(axis, stat, order=2, ddof=0, split_every=2):
+        chunk = top(partial(moment_chunk, axis=axis, order=order),
+                    'm', 'ij', 'x', 'ij', numblocks={'x': numblocks})
+        combine = lambda L: moment_combine(concatenate2(L, axes=axis),
+                                           axis=axis)
+        agg = lambda L: moment_agg(concatenate2(L, axes=axis), axis=axis,
+                                   stat=stat, order=order, ddof=ddof)
+        dsk = tree_reduce(combine, agg, 'm', numblocks, axis, 'out',
+                          split_every=split_every)
+        keys = [k for k in dsk if k[0] == 'out']
+        out = dask.get(merge(d, chunk, dsk), sorted(keys))
+        if len(axis) == x.ndim:
+            return out[0]
+        return np.concatenate(out)
+
+    x64 = x.astype('f8')
+    assert np.allclose(compute([0, 1], 'mean'), x64.mean())
+    assert np.allclose(compute([0, 1], 'var'), x64.var())
+    assert np.allclose(compute([0, 1], 'std', ddof=1), x64.std(ddof=1))
+    assert np.allclose(compute([0], 'var'), x64.var(axis=0))
+    assert np.allclose(compute([1], 'mean'), x64.mean(axis=1))
+
+    for order in [3, 4]:
+        expected = ((x64 - x64.mean()) ** order).mean()
+        assert np.allclose(compute([0, 1], 'moment', order=order), expected)
+
+
+def test_moment_chunk_of_empty_block():
+    x = np.ones((0, 3))
+    m = moment_chunk(x, axis=0)
+    parts = np.concatenate([m, moment_chunk(np.arange(6.).reshape((2, 3)),
+                                            axis=0)])
+    assert eq(moment_agg(parts, axis=0, stat='mean'), [1.5, 2.5, 3.5])
+
+
+def test_sum_blocks():
+    x = np.ones((2, 2), dtype='i4')
+    y = np.ones((2, 2), dtype='f8') / 2
+    assert eq(sum_blocks([x, x, y]), np.ones((2, 2)) * 2.5)
+    assert eq(sum_blocks(iter([iter([x, x]), [x]])), x * 3)
+    assert eq(x, np.ones((2, 2)))
+
+
+def test_split_contraction_dot_product():
+    x = np.arange(400).reshape((20, 20))
+    o = np.ones((20, 20))
+
+    d = {'x': x, 'o': o}
+
+    getx = getem('x', (5, 5), (20, 20))
+    geto = getem('o', (5, 5), (20, 20))
+
+    partials = top(np.dot, 'p', 'ikj', 'x', 'ij', 'o', 'jk',
+                   numblocks={'x': (4, 4), 'o': (4, 4)})
+    assert len(partials) == 64
+    result = tree_reduce(sum_blocks, sum_blocks, 'p', (4, 4, 4), (2,), 'out',
+                         split_every=2)
+
+    dsk = merge(d, getx, geto, partials, result)
+    out = dask.get(dsk, [[('out', i, j) for j in range(4)] for i in range(4)])
+
+    assert eq(np.dot(x, o), concatenate(out))
+
+
+def test_top_with_dummies_and_broadcasting():
+    assert top(dotmany, 'z', 'i', 'x', 'ij', 'y', 'j',
+               numblocks={'x': (2, 3), 'y': (1,)}) == \
+        {('z', 0): (dotmany, [('x', 0, 0), ('x', 0, 1), ('x', 0, 2)],
+                             [('y', 0), ('y', 0), ('y', 0)]),
+         ('z', 1): (dotmany, [('x', 1, 0), ('x', 1, 1), ('x', 1, 2)],
+                             [('y', 0), ('y', 0), ('y', 0)])}
+
+
+def test_top_keys_are_python_ints():
+    dsk = top(inc, 'z', 'ij', 'x', 'ij', numblocks={'x': (2, 3)})
+    assert all(type(i) is int for k in dsk for i in k[1:])
+    assert all(type(i) is int for v in dsk.values() for i in v[1][1:])
+
+
+def test_blockshape_from_chunks():
+    # Blocks are multiples of the chunks, clipped to the shape
+    assert blockshape_from_chunks((95, 7), (10, 7), 8, nbytes=10**6) == (95, 7)
+    bs = blockshape_from_chunks((1000, 50), (7, 50), 8, nbytes=10**4)
+    assert bs[0] % 7 == 0 and bs[1] == 50
+    assert bs[0] * bs[1] * 8 <= 10**4
+    assert blockshape_from_chunks((), (), 8) == ()
+
+
+def test_rechunk():
+    x = np.arange(120).reshape((10, 12))
+    old = blockdims_from_blockshape(x.shape, (3, 12))
+    dsk = merge({'x': x}, getem('x', (3, 12), x.shape))
+
+    for blockshape in [(10, 4), (4, 5), (3, 12), (10, 12)]:
+        new = blockdims_from_blockshape(x.shape, blockshape)
+        dsk2 = merge(dsk, rechunk('x', 'y', old, new))
+        keys = [[('y', i, j) for j in range(len(new[1]))]
+                             for i in range(len(new[0]))]
+        blocks = core.get(dsk2, keys)
+        assert blocks[0][0].shape == tuple(b[0] for b in new)
+        assert (concatenate(blocks) == x).all()
+
+
+def test_rechunk_pieces_ragged():
+    pieces = rechunk_pieces((3, 3, 3, 1), (5, 5))
+    assert pieces[0] == [(0, slice(0, 3)), (1, slice(0, 2))]
+    assert pieces[1] == [(1, slice(2, 3)), (2, slice(0, 3)), (3, slice(0, 1))]
+
+
+def test_getem_blockdims():
+    x = np.arange(24).reshape((4, 6))
+    dsk = merge({'x': x}, getem('x', blockdims=((1, 3), (4, 2))))
+    assert core.get(dsk, ('x', 1, 0)).shape == (3, 4)
+    assert (core.get(dsk, ('x', 1, 1)) == x[1:, 4:]).all()
+
+
+def test_slice_array():
+    x = np.arange(143).reshape((13, 11))
+    blockdims = ((5, 5, 3), (4, 4, 3))
+    dsk = merge({'x': x}, getem('x', blockdims=blockdims))
+
+    for index in [(slice(2, 9), 3), (slice(None, None, -3), slice(1, 10, 2)),
+                  (None, 4, Ellipsis), (Ellipsis, slice(-3, None))]:
+        slices, bd = slice_array('y', 'x', blockdims, index)
+        keys = [('y',) + ind
+                for ind in itertools.product(*[range(len(b)) for b in bd])]
+        result = dict(zip(keys, core.get(merge(dsk, slices), keys)))
+
+        expected = x[index]
+        assert tuple(map(sum, bd)) == expected.shape
+        starts = [np.cumsum((0,) + b) for b in bd]
+        for key, block in result.items():
+            ind = tuple(slice(s[i], s[i] + n) for i, s, n
+                        in zip(key[1:], starts, block.shape))
+            assert (expected[ind] == block).all()
+
+
+def test_slice_array_touches_only_needed_blocks():
+    slices, bd = slice_array('y', 'x', ((5, 5, 5), (5, 5)), (slice(6, 8), 2))
+    assert len(slices) == 1
+    assert list(slices.values())[0][1] == ('x', 1, 0)
+
+
+def test_ghost_and_trim():
+    x = np.arange(90).reshape((9, 10))
+    blockdims = ((4, 3, 2), (5, 5))
+    dsk = merge({'x': x}, getem('x', blockdims=blockdims))
+    starts = [np.cumsum((0,) + bd) for bd in blockdims]
+    modes = {'reflect': 'symmetric', 'periodic': 'wrap', 'nearest': 'edge',
+             7: 'constant'}
+
+    for boundary, mode in modes.items():
+        kwargs = {'constant_values': 7} if mode == 'constant' else {}
+        padded = np.pad(x, ((2, 2), (1, 1)), mode=mode, **kwargs)
+        ghosted, bd = ghost('x', 'y', blockdims, (2, 1), boundary)
+        trimmed = trim('y', 'z', blockdims, (2, 1), boundary)
+        dsk2 = merge(dsk, ghosted, trimmed)
+        for i, j in itertools.product(range(3), range(2)):
+            block = core.get(dsk2, ('y', i, j))
+            assert block.shape == (bd[0][i], bd[1][j])
+            expected = padded[starts[0][i]:starts[0][i] + bd[0][i],
+                              starts[1][j]:starts[1][j] + bd[1][j]]
+            assert (block == expected).all()
+            assert (core.get(dsk2, ('z', i, j)) ==
+                    core.get(dsk, ('x', i, j))).all()
+
+
+def test_ghost_none_boundary():
+    ghosted, bd = ghost('x', 'y', ((4, 4, 4),), 1, 'none')
+    assert bd == ((5, 6, 5),)
+    assert raises(ValueError, lambda: ghost('x', 'y', ((4, 1),), 2))
+
+
+def test_ghost_constant_boundary_with_inlined_sources():
+    from dask.threaded import get, inline
+    x = np.arange(16).reshape((4, 4))
+    blockdims = ((2, 2), (2, 2))
+    dsk = merge({'x': x}, getem('x', blockdims=blockdims))
+    ghosted, bd = ghost('x', 'y', blockdims, 1, 0)
+    dsk = inline(merge(dsk, ghosted), fast_functions=set([operator.getitem]))
+    result = get(dsk, [[('y', i, j) for j in range(2)] for i in range(2)])
+    padded = np.pad(x, 1, mode='constant')
+    assert (concatenate(result) ==
+            padded[[0, 1, 2, 3, 2, 3, 4, 5]][:, [0, 1, 2, 3, 2, 3, 4, 5]]).all()
+
+
+def test_cumulative():
+    x = np.arange(1, 61).reshape((6, 10))
+    dsk = merge({'x': x}, getem('x', (2, 3), x.shape))
+    for func, binop in [(np.cumsum, operator.add),
+                        (np.cumprod, operator.mul)]:
+        for axis in [0, 1]:
+            dsk2 = merge(dsk, cumulative(func, binop, 'x', 'y', (3, 4), axis))
+            result = concatenate(core.get(dsk2, [[('y', i, j)
+                                                  for j in range(4)]
+                                                  for i in range(3)]))
+            assert (result == func(x, axis=axis)).all()
@@ -0,0 +1,34 @@
+import os
+import shutil
+import tempfile
+import numpy as np
+from toolz import merge
+from dask.array import getem, concatenate
+from dask.threaded import get
+from dask.disk import *
+
+
+def test_round_trip():
+    path = tempfile.mkdtemp()
+    try:
+        x = np.arange(70, dtype='f4').reshape((7, 10))
+        for compression in sorted(compressors, key=str):
+            write_metadata(path, x.shape, (3, 4), x.dtype, compression)
+            dsk = merge({'x': x}, getem('x', (3, 4), x.shape),
+                        store_dask(path, 'x', 'store', (3, 3), compression))
+            get(dsk, [('store', i, j) for i in range(3) for j in range(3)])
+            assert os.path.exists(block_filename(path, (2, 2)))
+
+            dsk, meta = load_dask(path, 'y')
+            assert meta['shape'] == x.shape
+            assert meta['dtype'] == x.dtype
+            result = concatenate(get(dsk, [[('y', i, j) for j in range(3)]
+                                                        for i in range(3)]))
+            assert (result == x).all()
+    finally:
+        shutil.rmtree(path)
+
+
+def test_record_dtype():
+    dt = np.dtype([('a', 'i4'), ('b', 'f8', (2,))])
+    assert dtype_from_json(dtype_to_json(dt)) == dt
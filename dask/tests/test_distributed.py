@@ -0,0 +1,91 @@
+import os
+from operator import add, mul
+from dask.distributed import *
+from dask.utils import raises
+
+
+def inc(x):
+    return x + 1
+
+
+def append_pid(L):
+    return L + [os.getpid()]
+
+
+def bad(x):
+    raise ValueError()
+
+
+def test_get():
+    dsk = {'x': 1, 'y': 2, 'z': (inc, 'x'), 'w': (add, 'z', 'y')}
+    with Cluster(3) as c:
+        assert c.get(dsk, 'w') == 4
+        assert c.get(dsk, ['w', 'z']) == (4, 2)
+        assert get(dsk, [['w'], ['y', 'z']], c.addresses) == ((4,), (2, 2))
+
+
+def test_many_tasks_on_many_workers():
+    dsk = dict((('x', i), (inc, 'one')) for i in range(50))
+    dsk['one'] = 1
+    dsk['total'] = (sum, [('x', i) for i in range(50)])
+
+    with Cluster(3) as c:
+        assert c.get(dsk, 'total', nthreads=2) == 100
+        assert c.get(dsk, [('x', i) for i in range(3)]) == (2, 2, 2)
+
+
+def test_data_moves_between_workers():
+    dsk = {'a': 1, 'b': 2, 'c': 3,
+           'x': (add, 'a', 'b'), 'y': (mul, 'x', 'c')}
+    with Cluster(3) as c:
+        assert c.get(dsk, 'y') == 9
+
+
+def test_prefer_workers_that_hold_inputs():
+    dsk = {'x': [], 'a': (append_pid, 'x'), 'b': (append_pid, 'a'),
+           'c': (append_pid, 'b')}
+    with Cluster(3) as c:
+        pids = c.get(dsk, 'c')
+        assert len(pids) == 3
+        assert len(set(pids)) == 1
+        assert os.getpid() not in pids
+
+
+def test_data_is_released():
+    dsk = {'x': 1, 'y': (inc, 'x'), 'z': (inc, 'y')}
+    with Cluster(2) as c:
+        assert c.get(dsk, 'z') == 3
+        for address in c.addresses:
+            assert request(address, ('keys',)) == []
+
+
+def test_exceptions_rise_to_top():
+    dsk = {'x': 1, 'y': (bad, 'x')}
+    with Cluster(2) as c:
+        assert raises(ValueError, lambda: c.get(dsk, 'y'))
+        assert c.get({'x': 1, 'y': (inc, 'x')}, 'y') == 2
+
+
+def test_unix_sockets():
+    dsk = {'x': 1, 'y': 2, 'z': (inc, 'x'), 'w': (add, 'z', 'y')}
+    with Cluster(2, family='AF_UNIX') as c:
+        assert c.get(dsk, 'w') == 4
+
+
+def test_failed_requests_raise():
+    with Cluster(2) as c:
+        assert raises(KeyError, lambda: request(c.addresses[0], ('get', 'x')))
+        # A worker fails to fetch an input that its peer doesn't hold
+        request(c.addresses[0], ('put', 'x', 1))
+        request(c.addresses[0], ('delete', ['x']))
+        assert raises(KeyError, lambda: request(c.addresses[1],
+                ('compute', 'y', (inc, 'x'), {'x': c.addresses[0]})))
+
+
+def test_workers_require_authkey():
+    from multiprocessing import AuthenticationError
+    from multiprocessing.connection import Client
+    with Cluster(1) as c:
+        assert raises(AuthenticationError,
+                      lambda: Client(c.addresses[0], authkey=b'wrong'))
+        assert c.get({'x': 1, 'y': (inc, 'x')}, 'y') == 2
@@ -0,0 +1,82 @@
+import dask
+from dask.layers import *
+from dask.array import Top, top, getem, concatenate
+from toolz import merge
+import numpy as np
+
+
+inc = lambda x: x + 1
+
+
+def source(name, x, blockshape):
+    return LayeredDask({name: merge({name: x},
+                                    getem(name, blockshape, x.shape))},
+                       {name: set()})
+
+
+def test_layered_dask_is_a_dask():
+    x = np.arange(16).reshape((4, 4))
+    dsk = source('x', x, (2, 2))
+    dsk = add_layer(dsk, 'y', Top(inc, 'y', 'ij', 'x', 'ij',
+                                  numblocks={'x': (2, 2)}), ['x'])
+
+    assert ('y', 1, 1) in dsk
+    assert ('y', 2, 1) not in dsk
+    assert ('x', 0, 0) in dsk
+    assert len(dsk) == 1 + 4 + 4
+    assert set(dsk) == set(materialize(dsk))
+
+    out = dask.get(dsk, [[('y', i, j) for j in range(2)] for i in range(2)])
+    assert (concatenate(out) == x + 1).all()
+
+
+def test_layers_are_shared():
+    x = np.arange(16).reshape((4, 4))
+    dsk = source('x', x, (2, 2))
+    dsks = [dsk]
+    for i in range(10):
+        prev = 'x' if i == 0 else 'y%d' % (i - 1)
+        layer = Top(inc, 'y%d' % i, 'ij', prev, 'ij', numblocks={prev: (2, 2)})
+        dsks.append(add_layer(dsks[-1], 'y%d' % i, layer, [prev]))
+
+    assert dsks[-1].layers['x'] is dsk.layers['x']
+    assert dask.get(dsks[-1], ('y9', 1, 1)).tolist() == [[20, 21], [24, 25]]
+
+
+def test_materialize():
+    t = Top(inc, 'y', 'ij', 'x', 'ij', numblocks={'x': (2, 3)})
+    dsk = LayeredDask({'y': t, 'x': {'x': 1}}, {'y': set(['x']), 'x': set()})
+    result = materialize(dsk)
+    assert isinstance(result, dict)
+    assert result == merge({'x': 1}, top(inc, 'y', 'ij', 'x', 'ij',
+                                         numblocks={'x': (2, 3)}))
+    assert materialize({'x': 1}) == {'x': 1}
+
+
+def test_cull_tasks():
+    x = np.arange(16).reshape((4, 4))
+    a = add_layer(source('x', x, (2, 2)), 'a',
+                  Top(inc, 'a', 'ij', 'x', 'ij', numblocks={'x': (2, 2)}),
+                  ['x'])
+    b = add_layer(a, 'b', Top(inc, 'b', 'ij', 'a', 'ij',
+                              numblocks={'a': (2, 2)}), ['a'])
+
+    dsk = cull_tasks(b, [('b', 0, 1)])
+    assert set(dsk) == set([('b', 0, 1), ('a', 0, 1), ('x', 0, 1), 'x'])
+    assert dask.get(dsk, ('b', 0, 1)).tolist() == [[4, 5], [8, 9]]
+
+    assert set(cull_tasks(b, [[('b', 0, 0), ('b', 0, 1)]])) == \
+            set([('b', 0, 0), ('b', 0, 1), ('a', 0, 0), ('a', 0, 1),
+                 ('x', 0, 0), ('x', 0, 1), 'x'])
+    assert set(cull_tasks(b, ('a', 1, 1))) == \
+            set([('a', 1, 1), ('x', 1, 1), 'x'])
+
+
+def test_cull_tasks_plain_dicts():
+    dsk = {'x': 1, 'y': (inc, 'x'), 'z': (sum, ['y', 'x']), 'w': (inc, 'z')}
+    assert set(cull_tasks(dsk, 'z')) == set(['x', 'y', 'z'])
+
+    # Layers with unknown dependencies
+    d = merge_layers(source('x', np.ones(4), (2,)),
+                     {'d': (inc, ('x', 1)), 'e': (inc, ('x', 0))})
+    assert set(cull_tasks(d, 'd')) == set(['d', ('x', 1), 'x'])
@@ -3,6 +3,7 @@ from dask.array import *
 from dask.obj import *
 from into import convert, into
 from collections import Iterable
+from dask.utils import raises
 
 
 def eq(a, b):
@@ -107,3 +108,367 @@ def test_keys():
                                           for i in range(5)]
     d = Array({}, 'x', (), ())
     assert d.keys() == [('x',)]
+
+
+def test_convert_to_numpy_array_with_prefetch():
+    x = np.arange(600).reshape((20, 30))
+    d = convert(Array, x, blockshape=(4, 5))
+    x2 = convert(np.ndarray, d, prefetch=4)
+
+    assert eq(x, x2)
+
+
+def test_tree_reductions():
+    for expr in [sx.sum(), sx.sum(axis=0), sx.sum(axis=1), sx.min(),
+                 sx.max(axis=1), sx.count(), sx.mean(axis=0)]:
+        result = compute(expr, dask_ns, split_every=2)
+        expected = compute(expr, numpy_ns)
+        if expr.dshape.shape:
+            result2 = into(np.ndarray, result)
+        else:
+            result2 = into(float, result)
+        assert eq(result2, expected)
+
+    result = compute(sx.sum(), dask_ns, split_every=2)
+    assert any('partial' in str(k) for k in result.dask)
+
+
+def test_moments():
+    nz = (1e4 + np.random.random((20, 30))).astype('f4')
+    dz = convert(Array, nz, blockshape=(4, 5))
+    sz = symbol('z', discover(dz))
+
+    for expr in [sz.mean(), sz.mean(axis=0), sz.var(), sz.var(axis=1),
+                 sz.std(), sz.std(unbiased=True), sz.std(axis=0)]:
+        result = compute(expr, {sz: dz}, split_every=2)
+        expected = compute(expr, {sz: nz.astype('f8')})
+        if expr.dshape.shape:
+            result2 = into(np.ndarray, result)
+        else:
+            result2 = into(float, result)
+        assert np.allclose(result2, expected)
+
+
+def test_higher_moments():
+    nz = np.random.random((20, 30))
+    dz = convert(Array, nz, blockshape=(4, 5))
+    for order in [2, 3, 4]:
+        dev = nz - nz.mean(axis=0)
+        assert np.allclose(into(np.ndarray, dz.moment(order, axis=0)),
+                           (dev ** order).mean(axis=0))
+    assert np.allclose(into(float, dz.moment(3)),
+                       ((nz - nz.mean()) ** 3).mean())
+    assert dz.moment(3, axis=-1).shape == (20,)
+
+
+def test_tensordot_splits_contraction():
+    result = compute(sx.dot(sy), dask_ns, split_every=2)
+    # One task per pair of blocks along the contraction
+    assert sum(1 for k, v in result.dask.items()
+                 if isinstance(v, tuple) and v and
+                    getattr(v[0], 'func', None) is np.tensordot) == 5 * 5 * 6
+    assert eq(into(np.ndarray, result), nx.dot(ny))
+
+
+def test_atop_shares_layers():
+    result = compute(sx + 1, dask_ns)
+    assert result.dask.layers[dx.name] is dx.dask.layers[dx.name]
+    assert set(result.dask.dependencies[result.name]) == set([dx.name])
+
+
+def test_dtype():
+    assert dx.dtype == nx.dtype
+    assert compute(sx + 1, dask_ns).dtype == (nx + 1).dtype
+    assert compute(sx.sum(axis=0), dask_ns).dtype == nx.sum(axis=0).dtype
+    assert compute(sx.mean(), dask_ns).dtype == np.dtype('f8')
+    assert compute(sx.dot(sy), dask_ns).dtype == nx.dot(ny).dtype
+
+    a = atop(np.sqrt, 'y', 'i', Array({}, 'x', (10,), (5,), dtype='i2'), 'i')
+    assert a.dtype == np.sqrt(np.ones(1, dtype='i2')).dtype
+
+
+def test_discover_does_not_compute():
+    # No tasks, so computing any block would fail
+    a = Array({}, 'x', (10, 20), (5, 5), dtype='f4')
+    assert discover(a) == DataShape(10, 20, from_numpy((), 'f4').measure)
+
+
+def test_convert_to_numpy_array_in_place():
+    x = np.arange(600, dtype='i4').reshape((20, 30))
+    d = convert(Array, x, blockshape=(4, 7))
+    x2 = convert(np.ndarray, d)
+    assert x2.dtype == x.dtype
+    assert eq(x, x2)
+
+    # Without a known dtype we fall back to concatenation
+    d = Array(d.dask, d.name, d.shape, d.blockshape)
+    assert eq(convert(np.ndarray, d), x)
+
+
+def test_append_twice():
+    x = np.arange(600).reshape((20, 30))
+    a = into(Array, x, blockshape=(4, 5))
+    b = bcolz.zeros(shape=(0, 30), dtype=x.dtype, chunklen=8)
+
+    append(b, a)
+    append(b, a)
+    assert eq(b[:], np.concatenate([x, x]))
+
+
+def test_store_batches_small_blocks():
+    x = np.arange(600).reshape((20, 30))
+    a = into(Array, x, blockshape=(2, 5))
+    update = insert_to_ooc(np.empty_like(x), a, batch=4)
+    assert len(update) == 3 * 6
+
+
+def test_store_checks_block_shapes():
+    x = np.arange(600).reshape((20, 30))
+    a = into(Array, x, blockshape=(3, 5))
+    out = np.empty_like(x)
+    update = insert_to_ooc(out, a, batch=4)
+    get(merge_layers(a.dask, update), list(update))
+    assert eq(out, x)
+
+    bad = a.map_blocks(lambda b: b[:-1], dtype=x.dtype)
+    assert raises(ValueError, lambda: store(np.empty_like(x), bad))
+
+
+def test_store_empty():
+    for index in [slice(5, 5), slice(100, 200)]:
+        result = into(np.ndarray, dx[index])
+        assert result.shape == nx[index].shape
+    empty = Array({}, 'empty', (0, 30), blockdims=((), (30,)), dtype='i8')
+    assert store(np.empty((0, 30), dtype='i8'), empty).shape == (0, 30)
+
+
+def test_store_to_memmap():
+    from into.utils import tmpfile
+    x = np.arange(600).reshape((20, 30))
+    a = into(Array, x, blockshape=(4, 5))
+    with tmpfile('.npy') as fn:
+        m = np.lib.format.open_memmap(fn, mode='w+', dtype=x.dtype,
+                                      shape=x.shape)
+        store(m, a)
+        del m
+        assert eq(np.load(fn), x)
+
+
+def test_auto_blockshape_aligns_with_storage_chunks():
+    x = np.arange(6000).reshape((200, 30))
+    b = bcolz.carray(x, chunklen=16)
+    a = into(Array, b, blockshape='auto', nthreads=4)
+    assert a.blockshape[0] % 16 == 0
+    assert a.numblocks[0] >= 4
+    assert eq(into(np.ndarray, a), x)
+
+
+def test_npy_memmap_source_and_target():
+    from into.utils import tmpfile
+    x = np.arange(600).reshape((20, 30))
+    with tmpfile('.npy') as fn:
+        np.save(fn, x)
+        a = into(Array, fn, blockshape=(4, 5))
+        assert eq(into(np.ndarray, a), x)
+
+        # Blocks are views onto the mapped file
+        block = a._get_block(1, 1)
+        assert isinstance(block, np.memmap)
+
+        with tmpfile('.npy') as fn2:
+            m = into(fn2, a)
+            assert isinstance(m, np.memmap)
+            del m
+            assert eq(np.load(fn2), x)
+
+
+def test_to_disk_from_disk():
+    import tempfile, shutil
+    path = tempfile.mkdtemp()
+    try:
+        to_disk(dx, path)
+        a = from_disk(path)
+        assert a.blockshape == dx.blockshape
+        assert a.dtype == dx.dtype
+        assert eq(into(np.ndarray, a), nx)
+    finally:
+        shutil.rmtree(path)
+
+
+def test_rechunk():
+    for blockshape in [(20, 3), (7, 30), (20, 30)]:
+        a = dx.rechunk(blockshape)
+        assert a.blockshape == blockshape
+        assert a.dtype == dx.dtype
+        assert eq(into(np.ndarray, a), nx)
+    assert dx.rechunk(dx.blockshape) is dx
+
+
+def test_ragged_blockdims():
+    blockdims = ((5, 10, 5), (30,))
+    a = into(Array, nx, blockdims=blockdims)
+    assert a.blockdims == blockdims
+    assert a.numblocks == (3, 1)
+    assert a.blockshape == (10, 30)
+    assert a._get_block(1, 0).shape == (10, 30)
+
+    b = compute(sx + 1, {sx: a})
+    assert b.blockdims == blockdims
+    assert eq(into(np.ndarray, b), nx + 1)
+    assert eq(into(np.ndarray, compute(sx.sum(axis=1), {sx: a})),
+              nx.sum(axis=1))
+    assert eq(into(np.ndarray, a.rechunk((4, 5))), nx)
+    assert eq(into(np.ndarray, dx.rechunk(blockdims=blockdims)), nx)
+
+
+def test_getitem():
+    for index in [(slice(3, 9), 4), 2, (Ellipsis, slice(None, None, -2)),
+                  (None, slice(1, 20, 3))]:
+        a = dx[index]
+        assert a.shape == nx[index].shape
+        assert a.dtype == dx.dtype
+        assert eq(into(np.ndarray, a), nx[index])
+    assert dx[5:7].numblocks == (1, 6)
+
+
+class CountingArray(object):
+    """ Array-like that counts how often we read from it """
+    def __init__(self, x):
+        self.x = x
+        self.shape = x.shape
+        self.dtype = x.dtype
+        self.reads = 0
+
+    def __getitem__(self, index):
+        self.reads += 1
+        return self.x[index]
+
+
+def test_getitem_reads_only_needed_blocks():
+    source = CountingArray(nx)
+    a = array_to_dask(source, blockshape=(4, 5))
+    assert a.numblocks == (5, 6)
+    assert eq(into(np.ndarray, a[3:5, 4:6]), nx[3:5, 4:6])
+    assert source.reads == 4
+
+    calls = [0]
+    def f(x):
+        calls[0] += 1
+        return x + 1
+    b = a.map_blocks(f, dtype=a.dtype)[0:2, 0:2]
+    assert eq(into(np.ndarray, b), nx[0:2, 0:2] + 1)
+    assert calls[0] == 1
+
+
+def test_compute_slice():
+    for expr in [sx[2:5, 3], sx[::-1, 1:10:3], sx[4], (sx + 1)[:3].sum()]:
+        result = compute(expr, dask_ns)
+        expected = compute(expr, numpy_ns)
+        assert isinstance(result, Array)
+        if expr.dshape.shape:
+            assert eq(into(np.ndarray, result), expected)
+        else:
+            assert eq(into(float, result), expected)
+
+    source = CountingArray(nx)
+    a = array_to_dask(source, blockshape=(4, 5))
+    assert eq(into(np.ndarray, compute(sx[2:3, 6], {sx: a})), nx[2:3, 6])
+    assert source.reads == 1
+
+    source.reads = 0
+    result = compute((sx + 1)[:3].sum(), {sx: a})
+    assert eq(into(float, result), (nx + 1)[:3].sum())
+    assert source.reads == a.numblocks[1]
+
+
+def test_elemwise_operators():
+    assert eq(into(np.ndarray, (dx + 1) * dx - 2), (nx + 1) * nx - 2)
+    assert eq(into(np.ndarray, 2 ** (dx % 3)), 2 ** (nx % 3))
+    assert eq(into(np.ndarray, -dx / 2.0), -nx / 2.0)
+    assert eq(into(np.ndarray, dx > 100), nx > 100)
+    assert eq(into(np.ndarray, np.sin(dy) + da), np.sin(ny) + na)
+    assert (dx + 1.5).dtype == (nx + 1.5).dtype
+
+
+def test_elemwise_with_numpy_arrays():
+    assert eq(into(np.ndarray, dx + np.arange(30)), nx + np.arange(30))
+    assert eq(into(np.ndarray, dx * nx[:1]), nx * nx[:1])
+    a = np.add(nx, dx)
+    assert isinstance(a, Array)
+    assert eq(into(np.ndarray, a), nx + nx)
+    assert raises(ValueError, lambda: dx + np.arange(20))
+
+
+def test_elemwise_fuses():
+    a = (dy + 1) * dy - da
+    # One layer of tasks on top of the inputs, no intermediate blocks
+    assert set(a.dask.layers) == set([dy.name, da.name, a.name])
+    assert len(a.dask.layers[a.name]) == len(list(core.flatten(a.keys())))
+
+
+def test_elemwise_fuses_into_reductions():
+    for expr in [(sx ** 2).sum(), (sx + 1).sum(axis=1), (2 * sx).mean(),
+                 (sx + sy.T).var(axis=0)]:
+        result = compute(expr, dask_ns)
+        expected = compute(expr, numpy_ns)
+        if expr.dshape.shape:
+            assert np.allclose(into(np.ndarray, result), expected)
+        else:
+            assert np.allclose(into(float, result), expected)
+
+    result = compute((sx ** 2 + 1).sum(), dask_ns, split_every=100)
+    # Source, per-block chunks of the fused expression, and the aggregate
+    assert len(result.dask.layers) == 3
+
+
+def test_map_blocks():
+    a = dx.map_blocks(lambda b: b * 2)
+    assert a.blockdims == dx.blockdims
+    assert eq(into(np.ndarray, a), nx * 2)
+
+    b = dx.map_blocks(lambda b: b[::2, ::5], blockshape=(2, 1),
+                      dtype=nx.dtype)
+    assert b.shape == (10, 6)
+    assert b.dtype == nx.dtype
+    assert eq(into(np.ndarray, b), nx[::2, ::5])
+
+    c = (dx + 1).map_blocks(lambda b: b.sum(axis=0, keepdims=True),
+                            blockdims=((1,) * 5, (5,) * 6))
+    assert eq(into(np.ndarray, c), (nx + 1).reshape((5, 4, 30)).sum(axis=1))
+    assert raises(ValueError,
+                  lambda: dx.map_blocks(np.sin, blockdims=((20,), (30,))))
+
+    # Edge blocks of ragged arrays would not have the given blockshape
+    r = into(Array, np.arange(7), blockshape=(3,))
+    assert raises(ValueError,
+                  lambda: r.map_blocks(lambda b: b[::2], blockshape=(2,)))
+    d = r.map_blocks(lambda b: b[::2], blockdims=((2, 2, 1),))
+    assert d.shape == (5,)
+    assert eq(into(np.ndarray, d), np.array([0, 2, 3, 5, 6]))
+
+
+def test_map_overlap():
+    stencil = lambda b: np.roll(b, 1, axis=0) + np.roll(b, -1, axis=0)
+    a = dx.map_overlap(stencil, depth={0: 1}, boundary='periodic')
+    assert a.blockdims == dx.blockdims
+    assert eq(into(np.ndarray, a), stencil(nx))
+
+    b = dx.map_overlap(lambda b: b * 1.0, depth=2, boundary=0)
+    assert eq(into(np.ndarray, b), nx)
+
+
+def test_map_overlap_constant_boundary_through_get():
+    a = dx.map_overlap(lambda b: b * 2, depth=2, boundary=0, dtype=dx.dtype)
+    result = concatenate(get(a.dask, a.keys()))
+    assert eq(result, nx * 2)
+
+
+
+def test_cumulative():
+    for axis in [0, 1, -1]:
+        a = dx.cumsum(axis)
+        assert a.dtype == nx.cumsum(axis).dtype
+        assert eq(into(np.ndarray, a), nx.cumsum(axis))
+        assert eq(into(np.ndarray, (dx % 3 + 1).cumprod(axis)),
+                  (nx % 3 + 1).cumprod(axis))
+    assert raises(ValueError, lambda: dx.cumsum(2))
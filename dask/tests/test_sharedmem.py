@@ -0,0 +1,29 @@
+import os
+import pickle
+import numpy as np
+from dask.sharedmem import *
+
+
+def test_round_trip():
+    x = np.arange(12, dtype='f4').reshape((3, 4))
+    s = to_shared(x)
+    assert isinstance(s, SharedArray)
+    assert os.path.exists(s.filename)
+
+    s2 = pickle.loads(pickle.dumps(s))
+    y = from_shared(s2)
+    assert (x == y).all()
+    assert y.dtype == x.dtype
+
+    release(s)
+    assert not os.path.exists(s.filename)
+    assert (x == y).all()  # still mapped
+
+    release(s)  # idempotent
+
+
+def test_non_arrays_pass_through():
+    assert to_shared(1) == 1
+    assert from_shared(1) == 1
+    x = np.array(['a', 1], dtype=object)
+    assert to_shared(x) is x
@@ -3,6 +3,7 @@ from dask.threaded import *
 from contextlib import contextmanager
 from dask.utils import raises
 from operator import add, mul
+from toolz import first, second
 
 
 fib_dask = {'f0': 0, 'f1': 1, 'f2': 1, 'f3': 2, 'f4': 3, 'f5': 5, 'f6': 8}
@@ -160,3 +161,191 @@ def test_expand_key():
     assert expand_key(dsk, [inc], 'd') == 'd'
     assert expand_key(dsk, [inc], 'i') == (inc, 'x')
     assert expand_key(dsk, [inc], ['i', 'd']) == [(inc, 'x'), 'd']
+
+
+def test_prefetch():
+    dsk = dict((('load', i), (add, 'data', i)) for i in range(10))
+    dsk.update(dict((('x', i), (double, ('load', i))) for i in range(10)))
+    dsk['data'] = 1
+    dsk['total'] = (sum, [('x', i) for i in range(10)])
+
+    expected = get(dsk, 'total')
+    assert get(dsk, 'total', prefetch=2, io_functions=set([add])) == expected
+    assert get(dsk, 'total', prefetch=3, io_functions=set([add]),
+               nio_threads=2, nthreads=1) == expected
+
+
+def test_prefetch_is_bounded():
+    from threading import Lock
+    lock = Lock()
+    outstanding = [0, 0]  # current, maximum
+
+    def load(data, i):
+        with lock:
+            outstanding[0] += 1
+            outstanding[1] = max(outstanding)
+        return data[i]
+
+    def compute(x):
+        with lock:
+            outstanding[0] -= 1
+        return x
+
+    dsk = dict((('load', i), (load, 'data', i)) for i in range(20))
+    dsk['data'] = list(range(20))
+    dsk.update(dict((('x', i), (compute, ('load', i))) for i in range(20)))
+    dsk['total'] = (sum, [('x', i) for i in range(20)])
+
+    assert get(dsk, 'total', prefetch=3, io_functions=set([load]),
+               nthreads=2) == sum(range(20))
+    assert outstanding[1] <= 3
+
+
+def test_prefetch_does_not_deadlock_on_wide_tasks():
+    dsk = dict((('load', i), (add, 'data', i)) for i in range(10))
+    dsk['total'] = (sum, [('load', i) for i in range(10)])
+    dsk['data'] = 1
+
+    assert get(dsk, 'total', prefetch=2, io_functions=set([add])) == 55
+
+
+def test_task_function_in():
+    assert task_function_in((inc, 1), set([inc]))
+    assert task_function_in((partial(add, 1), 1), set([add]))
+    assert not task_function_in((inc, 1), set([add]))
+    assert not task_function_in(1, set([add]))
+
+
+def parse(s):
+    import os
+    return int(s), os.getpid()
+
+
+def test_process_functions():
+    import os
+    dsk = {'s': '1', 'parsed': (parse, 's'),
+           'x': (first, 'parsed'), 'pid': (second, 'parsed'),
+           'y': (inc, 'x')}
+
+    assert get(dsk, 'y', process_functions=set([parse]), nprocesses=2) == 2
+    assert get(dsk, 'pid', process_functions=set([parse]),
+               nprocesses=2) != os.getpid()
+    assert get(dsk, 'pid') == os.getpid()
+
+
+def test_process_functions_with_lists():
+    dsk = {'a': 1, 'b': 2, 'c': (sum, [(inc, 'a'), (inc, 'b')]),
+           'd': (inc, 'c')}
+
+    assert get(dsk, 'd', process_functions=set([sum]), nprocesses=2) == 6
+
+
+def test_exceptions_rise_to_top_from_processes():
+    dsk = {'x': 1, 'y': (bad, 'x')}
+    assert raises(ValueError, lambda: get(dsk, 'y', nprocesses=1,
+                                          process_functions=set([bad])))
+
+
+def ones(n):
+    import numpy as np
+    return np.ones(n)
+
+
+def test_shared_memory():
+    import numpy as np
+    dsk = {'n': 5, 'x': (ones, 'n'), 'y': (double, 'x'), 'z': (np.sum, 'y')}
+    pf = set([ones, double])
+
+    assert get(dsk, 'z', process_functions=pf, nprocesses=2,
+               shared_memory=True) == 10
+    y = get(dsk, 'y', process_functions=pf, nprocesses=2, shared_memory=True)
+    assert (y == 2).all()
+
+
+def test_shared_memory_is_released():
+    import os
+    from dask.sharedmem import default_dir
+    before = set(os.listdir(default_dir))
+    dsk = {'n': 5, 'x': (ones, 'n'), 'y': (double, 'x'), 'z': (double, 'y')}
+    get(dsk, 'z', process_functions=set([ones, double]), shared_memory=True)
+    assert set(os.listdir(default_dir)) == before
+
+
+def test_inplace_functions():
+    import numpy as np
+    outs = []
+
+    def add_out(x, y, out=None):
+        outs.append(out)
+        return np.add(x, y, out=out)
+
+    x = np.ones(5)
+    dsk = {'x': x, 'a': (double, 'x'), 'b': (add_out, 'a', 1),
+           'c': (add_out, 'b', 'b')}
+    result = get(dsk, 'c', inplace_functions=set([add_out]))
+    assert (result == 6).all()
+    assert (x == 1).all()  # Source data untouched
+    assert all(out is not None for out in outs)
+    assert result is outs[0]
+
+
+def test_inplace_functions_respect_other_dependents():
+    import numpy as np
+    outs = []
+
+    def add_out(x, y, out=None):
+        outs.append(out)
+        return np.add(x, y, out=out)
+
+    dsk = {'x': np.ones(5), 'a': (double, 'x'), 'b': (add_out, 'a', 1),
+           'c': (add_out, 'x', 1), 'd': (sum, ['a', 'b'])}
+    result = get(dsk, ['b', 'c', 'd'], inplace_functions=set([add_out]))
+    assert outs == [None, None]
+    assert (result[0] == 3).all()
+    assert (result[1] == 2).all()
+    assert (result[2] == 5).all()
+
+
+def test_inplace_functions_fall_back_on_bad_outputs():
+    import numpy as np
+    dsk = {'x': np.arange(5), 'a': (double, 'x'),
+           'b': (np.true_divide, 'a', 2)}
+    result = get(dsk, 'b', inplace_functions=set([np.true_divide]))
+    assert result.dtype == np.float64
+    assert (result == np.arange(5)).all()
+
+
+def test_inplace_functions_keep_result_dtype():
+    import numpy as np
+    dsk = {'x': np.arange(5.), 'a': (double, 'x'), 'b': (double, 'x'),
+           'g': (np.greater, 'a', 'b')}
+    result = get(dsk, 'g', inplace_functions=set([np.greater]))
+    assert result.dtype == bool
+
+    def add_out(x, y, out=None):
+        return np.add(x, y, out=out)
+
+    dsk = {'x': np.arange(5.), 'a': (np.float32, 'x'),
+           'b': (add_out, 'a', 'x')}
+    result = get(dsk, 'b', inplace_functions=set([add_out]))
+    assert result.dtype == np.float64
+
+
+def test_reusable_input_respects_lists():
+    import numpy as np
+    for task in [(add, 'y', ['y', 'x']),
+                 (add, 'y', (sum, ['x', (double, 'y')]))]:
+        dsk = {'x': np.ones(5), 'y': (double, 'x'), 'z': task}
+        state = start_state_from_dask(dsk)
+        state['cache']['y'] = np.ones(5) * 2
+        assert reusable_input(dsk, 'z', state, set(['z'])) is None
+
+
+def test_inplace_functions_leave_source_data_alone():
+    import numpy as np
+    for passthrough in [lambda x: x, np.asarray, np.ascontiguousarray]:
+        src = np.ones(5)
+        dsk = {'X': src, 'y': (passthrough, 'X'), 'z': (np.add, 'y', 1)}
+        result = get(dsk, 'z', inplace_functions=set([np.add]))
+        assert (result == 2).all()
+        assert (src == 1).all()
@@ -38,6 +38,11 @@ Changing state
 4.  waiting_data: available data to yet-to-be-run-tasks :: {key: {keys}}
     Real-time equivalent of dependents
 
+### Optional
+
+1.  shared: results held in shared memory :: {key: SharedArray}
+    Present only when using the ``shared_memory`` option of ``get``
+
 
 Example
 -------
@@ -92,12 +97,56 @@ that require them.  This may result in repeated computation but saves
 significantly on space and computation complexity.
 
 See the function ``inline`` for more information.
+
+
+Prefetching source data
+-----------------------
+
+Tasks that read source data from disk, like the ``operator.getitem`` tasks
+that pull blocks out of an HDF5 or bcolz dataset, spend most of their time
+waiting on I/O.  Optionally we run these tasks on a separate small thread pool
+and fire them a bounded number of blocks ahead of the compute tasks that
+consume them.  Disk reads and computation then overlap.
+
+See the ``prefetch`` and ``io_functions`` keywords of ``get`` for more
+information.
+
+
+Processes for code that holds the GIL
+-------------------------------------
+
+Threads work well for NumPy functions that release the GIL but serialize pure
+Python code.  Tasks that call one of a set of ``process_functions`` run in a
+pool of processes instead.  The scheduler state stays in this process; we send
+a task only the data on which it depends and get back its result.
+
+Pickling large NumPy arrays between processes is expensive.  With
+``shared_memory=True`` array results of process tasks go into shared memory
+(see the ``sharedmem`` module) and only small descriptors cross between
+processes.  We free this memory when we release the data.
+
+See the ``process_functions`` keyword of ``get`` for more information.
+
+
+Reuse memory of data on its last use
+------------------------------------
+
+Long chains of elementwise operations like ``x + 1`` allocate a new array for
+each result even when no one will use the input again.  The ``waiting_data``
+state tells us when a task is the last consumer of a piece of data.  Functions
+that accept an ``out=`` keyword, like NumPy ufuncs, may then write their result
+into that input's memory.
+
+See the function ``reusable_input`` and the ``inplace_functions`` keyword of
+``get`` for more information.
 """
-from .core import istask, flatten, reverse_dict, get_dependencies, ishashable
+from .core import (istask, flatten, reverse_dict, get_dependencies,
+        ishashable)
 from .utils import deepmap
 from operator import add
 from toolz import concat, partial
 from multiprocessing.pool import ThreadPool
+from multiprocessing import Pool
 from .compatibility import Queue
 from threading import Lock
 import psutil
@@ -223,16 +272,152 @@ def _execute_task(arg, cache, dsk=None):
         return arg
 
 
-def execute_task(dsk, key, state, queue, results, lock):
+def _execute_task_shared(task, data):
+    """ Execute task in a worker process, pass arrays through shared memory
+
+    See Also:
+        sharedmem
+    """
+    from .sharedmem import from_shared, to_shared
+    data = dict((k, from_shared(v)) for k, v in data.items())
+    return to_shared(_execute_task(task, data))
+
+
+def reusable_input(dsk, key, state, results):
+    """ Find an input array of this task that we may overwrite
+
+    The input must be
+
+    1.  the result of another task, and not source data passed through by
+        that task, e.g. by ``np.asarray``
+    2.  used by no other task after this one, and not a desired result
+    3.  an array that owns its memory and has no views held in the cache
+    4.  a direct argument of this task, not used by nested tasks
+
+    Returns None if there is no such input.  Call with the lock held.
+
+    >>> import numpy as np
+    >>> dsk = {'x': np.ones(3), 'y': (double, 'x'), 'z': (add, 'y', 1)}
+    >>> state = start_state_from_dask(dsk)
+    >>> state['cache']['y'] = np.ones(3) * 2
+    >>> reusable_input(dsk, 'z', state, set(['z'])) is state['cache']['y']
+    True
+    >>> reusable_input(dsk, 'y', state, set(['z'])) is None  # Source data
+    True
+    """
+    task = dsk[key]
+    cache = state['cache']
+    if 'sources' not in state:  # ids of source data, recorded once
+        state['sources'] = set(id(v) for v in dsk.values() if not istask(v))
+    sources = state['sources']
+    nested = set()
+    stack = [arg for arg in task[1:] if istask(arg) or isinstance(arg, list)]
+    while stack:
+        arg = stack.pop()
+        if istask(arg):
+            stack.extend(arg[1:])
+        elif isinstance(arg, list):
+            stack.extend(arg)
+        elif ishashable(arg) and arg in dsk:
+            nested.add(arg)
+    for arg in task[1:]:
+        if (not ishashable(arg) or arg not in cache or arg in nested
+                or arg in results or not istask(dsk.get(arg))
+                or state['waiting_data'].get(arg) != set([key])):
+            continue
+        x = cache[arg]
+        flags = getattr(x, 'flags', None)
+        if flags is None or not flags.owndata or not flags.writeable:
+            continue
+        base = x
+        while base is not None and id(base) not in sources:
+            base = getattr(base, 'base', None)
+        if base is not None:
+            continue
+        if any(v is x or getattr(v, 'base', None) is x
+               for k, v in cache.items() if k != arg):
+            continue
+        return x
+
+
+def out_kwargs(func, args, out):
+    """ Keyword arguments to write ``func(*args)`` into the array ``out``
+
+    The result must have exactly the dtype and shape of ``out``, otherwise
+    NumPy would silently cast it, e.g. ``np.greater`` would give floats.
+    Ufuncs check this themselves with ``casting='no'``.  For other functions
+    we expect the dtype and shape of ``args`` broadcast together.
+
+    Returns None if we can not write into ``out``.
+
+    >>> import numpy as np
+    >>> x = np.ones(3)
+    >>> out_kwargs(np.add, [x, 1], x) == {'out': x, 'casting': 'no'}
+    True
+    >>> out_kwargs(lambda a, b, out=None: a + b, [x, x.astype('f4')],
+    ...            x.astype('f4'))
+    """
+    import numpy as np
+    if isinstance(func, np.ufunc):
+        return {'out': out, 'casting': 'no'}
+    try:
+        if (np.result_type(*args) != out.dtype or
+                np.broadcast(*args).shape != out.shape):
+            return None
+    except (ValueError, TypeError):
+        return None
+    return {'out': out}
+
+
+def execute_task(dsk, key, state, queue, results, lock, process_pool=None,
+                 inplace=False):
     """
     Compute task and handle all administration
 
+    If given a ``process_pool`` then run the task in another process.  We send
+    along only the data on which this task depends.
+
+    If ``inplace`` then we may pass an input array that no other task needs as
+    the ``out=`` keyword argument to the task's function, see ``out_kwargs``.
+
     See also:
         _execute_task - actually execute task
+        reusable_input - find an input that we may overwrite
     """
     try:
         task = dsk[key]
-        result = _execute_task(task, state['cache'], dsk=dsk)
+        if inplace:
+            with lock:
+                out = reusable_input(dsk, key, state, results)
+        else:
+            out = None
+        if process_pool is not None and 'shared' in state:
+            from .sharedmem import SharedArray, from_shared
+            shared = state['shared']
+            data = dict((dep, shared.get(dep, state['cache'][dep]))
+                        for dep in state['dependencies'][key])
+            result = process_pool.apply(_execute_task_shared,
+                                        args=(task, data))
+            if isinstance(result, SharedArray):
+                with lock:
+                    shared[key] = result
+                result = from_shared(result)
+        elif process_pool is not None:
+            data = dict((dep, state['cache'][dep])
+                        for dep in state['dependencies'][key])
+            result = process_pool.apply(_execute_task, args=(task, data))
+        elif out is not None:
+            func, args = task[0], task[1:]
+            args2 = [_execute_task(a, state['cache'], dsk=dsk) for a in args]
+            kwargs = out_kwargs(func, args2, out)
+            try:
+                if kwargs is None:
+                    raise TypeError()
+                result = func(*args2, **kwargs)
+            except (ValueError, TypeError):  # e.g. shape or dtype mismatch
+                result = func(*args2)
+        else:
+            result = _execute_task(task, state['cache'], dsk=dsk)
         with lock:
             finish_task(dsk, key, result, state, results)
         result = key, task, result, None
@@ -296,6 +481,10 @@ def release_data(key, state):
 
     del state['cache'][key]
 
+    if key in state.get('shared', ()):
+        from .sharedmem import release
+        release(state['shared'].pop(key))
+
 
 def nested_get(ind, coll, lazy=False):
     """ Get nested index from collection
@@ -336,7 +525,7 @@ def score(key, state):
     return sum([1./len(wait[dep])**2 for dep in deps])
 
 
-def choose_task(state, score=score):
+def choose_task(state, score=score, keys=None):
     """
     Select a task that maximizes scoring function
 
@@ -358,10 +547,52 @@ def choose_task(state, score=score):
     partially free up resource x.  Task b only partially frees up resources x
     and w and completely frees none so it is given a lower score.
 
+    Optionally restrict the choice to a subset of ready ``keys``.
+
     See also:
         score
     """
-    return max(state['ready'], key=partial(score, state=state))
+    return max(keys or state['ready'], key=partial(score, state=state))
+
+
+def prefetch_score(key, state):
+    """ Prefer to read data that will soon let a compute task run
+
+    Scores I/O tasks by how close their dependents are to being ready.
+
+    >>> dsk = {'x': 1, 'a': (inc, 'x'), 'b': (inc, 'x'), 'c': (inc, 'x'),
+    ...        'y': (add, 'a', 'b'), 'z': (inc, 'c')}
+    >>> state = start_state_from_dask(dsk)
+    >>> prefetch_score('c', state) > prefetch_score('a', state)
+    True
+    """
+    waiting = state['waiting']
+    deps = state['dependents'][key]
+    if not deps:
+        return 0
+    return -min(len(waiting.get(dep, ())) for dep in deps)
+
+
+def task_function_in(task, functions):
+    """ Does this task call one of these functions?
+
+    Supports partials and curries
+
+    >>> task_function_in((inc, 'x'), set([inc]))
+    True
+    >>> task_function_in((partial(add, 1), 'x'), set([add]))
+    True
+    >>> task_function_in((double, 'x'), set([inc]))
+    False
+    >>> task_function_in('x', set([inc]))
+    False
+    """
+    if not istask(task):
+        return False
+    func = task[0]
+    if hasattr(func, 'func'):  # Support partials, curries
+        func = func.func
+    return func in functions
 
 
 '''
@@ -463,7 +694,10 @@ def expand_value(dsk, fast, key):
 The main function of the scheduler.  Get is the main entry point.
 '''
 
-def get(dsk, result, nthreads=psutil.NUM_CPUS, cache=None, debug_counts=None, **kwargs):
+def get(dsk, result, nthreads=psutil.NUM_CPUS, cache=None, debug_counts=None,
+        prefetch=0, io_functions=None, nio_threads=1,
+        process_functions=None, nprocesses=psutil.NUM_CPUS,
+        shared_memory=False, inplace_functions=None, **kwargs):
     """ Threaded cached implementation of dask.get
 
     Parameters
@@ -479,6 +713,24 @@ def get(dsk, result, nthreads=psutil.NUM_CPUS, cache=None, debug_counts=None, **
         Temporary storage of results
     debug_counts: integer or None
         This integer tells how often the scheduler should dump debugging info
+    prefetch: integer
+        How many blocks of source data we may read ahead of computation
+    io_functions: set of callables (optional)
+        Functions, like ``operator.getitem``, whose tasks read source data.
+        With ``prefetch`` these run on a dedicated I/O thread pool
+    nio_threads: integer
+        The number of threads in the I/O thread pool
+    process_functions: set of callables (optional)
+        Functions that hold the GIL, like pure Python parsing code.  Tasks
+        calling these run in a pool of processes rather than in threads
+    nprocesses: integer
+        The number of processes in the process pool
+    shared_memory: boolean
+        Move NumPy arrays to and from processes through shared memory
+    inplace_functions: set of callables (optional)
+        Functions that accept an ``out=`` keyword argument, like NumPy ufuncs.
+        We pass these an input array that no other task needs to avoid
+        allocating a new result
 
     Examples
     --------
@@ -495,10 +747,38 @@ def get(dsk, result, nthreads=psutil.NUM_CPUS, cache=None, debug_counts=None, **
         result_flat = set([result])
     results = set(result_flat)
 
+    # Tasks that hold the GIL, these run in other processes.  Fork these
+    # before we start any threads, which might hold locks as we fork.
+    if process_functions:
+        process_keys = set(k for k, v in dsk.items()
+                             if task_function_in(v, process_functions))
+    else:
+        process_keys = set()
+    process_pool = Pool(nprocesses) if process_keys else None
+
     pool = ThreadPool(nthreads)
 
     state = start_state_from_dask(dsk, cache=cache)
 
+    # Tasks that read source data, these may run ahead on the I/O pool
+    if prefetch and io_functions:
+        io_keys = set(k for k, v in dsk.items()
+                        if task_function_in(v, io_functions))
+    else:
+        io_keys = set()
+    io_pool = ThreadPool(nio_threads) if io_keys else None
+    io_active = set()  # Read, or being read, but not yet released
+
+    if process_keys and shared_memory:
+        state['shared'] = dict()
+
+    # Tasks that may overwrite an input array
+    if inplace_functions:
+        inplace_keys = set(k for k, v in dsk.items()
+                             if task_function_in(v, inplace_functions))
+    else:
+        inplace_keys = set()
+
     queue = Queue()
     #lock for state dict updates
     #When a task completes, we need to update several things in the state dict.
@@ -510,26 +790,47 @@ def get(dsk, result, nthreads=psutil.NUM_CPUS, cache=None, debug_counts=None, **
     if not state['ready']:
         raise ValueError("Found no accessible jobs in dask")
 
-    def fire_task():
+    def fire_task(key, pool=pool):
         """ Fire off a task to the thread pool """
         # Update heartbeat
         tick[0] += 1
         # Emit visualization if called for
         if debug_counts and tick[0] % debug_counts == 0:
             visualize(dsk, state, filename='dask_%03d' % tick[0])
-        # Choose a good task to compute
-        key = choose_task(state)
         state['ready'].remove(key)
         state['running'].add(key)
         # Submit
         pool.apply_async(execute_task, args=[dsk, key, state, queue, results,
-                                             lock])
+                                             lock],
+                         kwds={'process_pool': process_pool
+                                   if key in process_keys else None,
+                               'inplace': key in inplace_keys})
+
+    def fire_tasks():
+        """ Fill the thread pools with good tasks to run """
+        compute_ready = state['ready'] - io_keys
+        while compute_ready and len(state['running'] - io_keys) < nthreads:
+            # Choose a good task to compute
+            key = choose_task(state, keys=compute_ready)
+            compute_ready.remove(key)
+            fire_task(key)
+
+        if not io_keys:
+            return
+        io_active.intersection_update(set(state['cache']) | state['running'])
+        io_ready = state['ready'] & io_keys
+        while io_ready and (len(io_active) < prefetch
+                            or not state['running']):  # avoid deadlock
+            # Read the data that the compute frontier will need next
+            key = choose_task(state, score=prefetch_score, keys=io_ready)
+            io_ready.remove(key)
+            io_active.add(key)
+            fire_task(key, pool=io_pool)
 
     try:
-        # Seed initial tasks into the thread pool
+        # Seed initial tasks into the thread pools
         with lock:
-            while state['ready'] and len(state['running']) < nthreads:
-                fire_task()
+            fire_tasks()
 
         # Main loop, wait on tasks to finish, insert new ones
         while state['waiting'] or state['ready'] or state['running']:
@@ -539,13 +840,19 @@ def get(dsk, result, nthreads=psutil.NUM_CPUS, cache=None, debug_counts=None, **
                 traceback.print_tb(tb)
                 raise res
             with lock:
-                while state['ready'] and len(state['running']) < nthreads:
-                    fire_task()
+                fire_tasks()
 
     finally:
-        # Clean up thread pool
-        pool.close()
-        pool.join()
+        # Clean up thread and process pools
+        for p in [pool, io_pool, process_pool]:
+            if p is not None:
+                p.close()
+                p.join()
+        # Free shared memory, results already mapped here remain valid
+        if 'shared' in state:
+            from .sharedmem import release
+            for s in state.pop('shared').values():
+                release(s)
 
     # Final reporting
     while not queue.empty():